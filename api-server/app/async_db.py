@@ -0,0 +1,54 @@
+"""
+Async facade over db_queries: each helper runs on a bounded thread pool so
+psycopg2 calls never block the event loop.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db_queries
+from app.config import DB_EXECUTOR_WORKERS
+
+_executor = ThreadPoolExecutor(
+    max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db"
+)
+
+
+async def run_db(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, functools.partial(fn, *args, **kwargs)
+    )
+
+
+def run_db_in_background(fn, *args, **kwargs):
+    """Fire-and-forget a blocking helper from a non-async context."""
+    return _executor.submit(fn, *args, **kwargs)
+
+
+def _async(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_db(fn, *args, **kwargs)
+
+    return wrapper
+
+
+get_request_by_id = _async(db_queries.get_request_by_id)
+insert_request = _async(db_queries.insert_request)
+insert_or_join_request = _async(db_queries.insert_or_join_request)
+mark_request_failed = _async(db_queries.mark_request_failed)
+insert_user = _async(db_queries.insert_user)
+get_user_by_username = _async(db_queries.get_user_by_username)
+get_user_id_by_username = _async(db_queries.get_user_id_by_username)
+save_trip_to_history = _async(db_queries.save_trip_to_history)
+get_user_history = _async(db_queries.get_user_history)
+get_user_trip = _async(db_queries.get_user_trip)
+find_existing_trip = _async(db_queries.find_existing_trip)
+get_cached_plan = _async(db_queries.get_cached_plan)
+get_route_detail = _async(db_queries.get_route_detail)
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
@@ -6,3 +6,65 @@ STATE_DB_URL = os.getenv("STATE_DB_URL")
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS512")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRATION_MINUTES", 60))
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 5))
+DB_POOL_PING_AFTER_SECONDS = float(os.getenv("DB_POOL_PING_AFTER_SECONDS", 30))
+
+# Threads that run blocking work off the event loop. DB threads match the pool
+# size so a thread never sits waiting on a connection; bcrypt is CPU bound.
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", DB_POOL_MAX_SIZE))
+BCRYPT_EXECUTOR_WORKERS = int(
+    os.getenv("BCRYPT_EXECUTOR_WORKERS", min(4, os.cpu_count() or 1))
+)
+
+# Producer tuning: a short linger lets concurrent /submit calls share a batch.
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", 5))
+KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", 32768))
+KAFKA_COMPRESSION_TYPE = os.getenv("KAFKA_COMPRESSION_TYPE", "gzip") or None
+KAFKA_ACKS = os.getenv("KAFKA_ACKS", "1")
+KAFKA_CLOSE_TIMEOUT_SECONDS = float(os.getenv("KAFKA_CLOSE_TIMEOUT_SECONDS", 10))
+# send() runs on the event loop: cap how long it may block on metadata or a
+# full buffer before /submit gives up with a 503
+KAFKA_MAX_BLOCK_MS = int(os.getenv("KAFKA_MAX_BLOCK_MS", 500))
+
+# trip_requests is created (or grown) to this many partitions at startup; the
+# message key picks the partition: "user_id", "fingerprint" or "none"
+KAFKA_TOPIC_PARTITIONS = int(os.getenv("KAFKA_TOPIC_PARTITIONS", 12))
+KAFKA_TOPIC_REPLICATION_FACTOR = int(os.getenv("KAFKA_TOPIC_REPLICATION_FACTOR", 1))
+KAFKA_PARTITION_KEY = os.getenv("KAFKA_PARTITION_KEY", "user_id")
+
+# Priority lanes: trips whose estimated cost (days + interests / 2) reaches
+# LONG_TRIP_MIN_COST go to shared.config.KAFKA_TOPIC_LONG so they never queue
+# in front of short ones. KAFKA_PARTITION_KEY=user_id then orders a user's
+# requests within each lane only, not across lanes.
+LONG_TRIP_MIN_COST = float(os.getenv("LONG_TRIP_MIN_COST", 7))
+
+# Cross-user plan cache (see shared.fingerprint); the worker fills it
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+
+# Identical submissions within this window attach to the in-flight leader
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+COALESCE_WINDOW_SECONDS = int(os.getenv("COALESCE_WINDOW_SECONDS", 600))
+
+# Push delivery of request updates (Postgres LISTEN/NOTIFY). Not configurable:
+# the notify_request_update() trigger in the state DB sends on this channel.
+NOTIFY_CHANNEL = "request_updates"
+STATUS_LONG_POLL_MAX_SECONDS = float(os.getenv("STATUS_LONG_POLL_MAX_SECONDS", 30))
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", 15))
+
+# Versioned schema migrations applied at startup (databases/state-db/migrations)
+RUN_MIGRATIONS = os.getenv("RUN_MIGRATIONS", "true").lower() == "true"
+MIGRATIONS_DIR = os.getenv("MIGRATIONS_DIR", "/app/migrations")
+
+# username -> user_id cache for tokens issued before they carried a user_id claim
+USER_ID_CACHE_SIZE = int(os.getenv("USER_ID_CACHE_SIZE", 10000))
+USER_ID_CACHE_TTL_SECONDS = float(os.getenv("USER_ID_CACHE_TTL_SECONDS", 300))
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1000))
+
+# Prometheus metrics on /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
@@ -0,0 +1,142 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+from app.config import (
+    STATE_DB_URL,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_TIMEOUT_SECONDS,
+    DB_POOL_PING_AFTER_SECONDS,
+)
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection frees up within DB_POOL_TIMEOUT_SECONDS."""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool fails fast when empty; the semaphore makes callers
+# wait (up to the timeout) for a connection to be returned instead.
+_slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE)
+_last_used = {}
+
+_stats_lock = threading.Lock()
+_stats = {
+    "checkouts": 0,
+    "waits": 0,
+    "exhausted": 0,
+    "health_check_failures": 0,
+    "in_use": 0,
+}
+
+
+def _bump(key, delta=1):
+    with _stats_lock:
+        _stats[key] += delta
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pg_pool.ThreadedConnectionPool(
+                    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, STATE_DB_URL
+                )
+    return _pool
+
+
+def get_pool_stats():
+    """
+    Snapshot of the pool counters shared by every query helper.
+    `exhausted` counts checkouts that timed out waiting for a free connection.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["min_size"] = DB_POOL_MIN_SIZE
+    stats["max_size"] = DB_POOL_MAX_SIZE
+    return stats
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_PING_AFTER_SECONDS:
+        return True
+    # Only ping connections that sat idle long enough to have been dropped
+    # by the server or a proxy in between.
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _checkout():
+    pool = get_pool()
+    conn = pool.getconn()
+    while not _is_healthy(conn):
+        _bump("health_check_failures")
+        _last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    return conn
+
+
+@contextmanager
+def get_connection():
+    """
+    Borrow a pooled connection for the duration of the block.
+    Commits on success, rolls back on error, and always returns the connection.
+    """
+    if not _slots.acquire(blocking=False):
+        _bump("waits")
+        if not _slots.acquire(timeout=DB_POOL_TIMEOUT_SECONDS):
+            _bump("exhausted")
+            raise PoolExhaustedError(
+                f"No database connection available after {DB_POOL_TIMEOUT_SECONDS}s"
+            )
+    try:
+        conn = _checkout()
+    except Exception:
+        _slots.release()
+        raise
+
+    _bump("checkouts")
+    _bump("in_use")
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        broken = broken or conn.closed != 0
+        if broken:
+            _last_used.pop(id(conn), None)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+        get_pool().putconn(conn, close=broken)
+        _bump("in_use", -1)
+        _slots.release()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
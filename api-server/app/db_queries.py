@@ -1,47 +1,108 @@
 import psycopg2
+import psycopg2.extras
 from psycopg2.extras import RealDictCursor
-from app.config import STATE_DB_URL
-import bcrypt
+from app.db_pool import get_connection
+from shared.fingerprint import trip_fingerprint, content_hash
+from shared.logs import get_logger
 
+log = get_logger(__name__)
 
-def get_connection():
-    return psycopg2.connect(STATE_DB_URL)
 
-
-def get_request_by_id(request_id: str):
+def get_request_by_id(request_id: str, known_hashes=()):
     """
-    Fetch the status, user_id, result, and payload JSON for a given request_id from the state-db.requests table.
-    Returns a dict like {'status': ..., 'user_id': ..., 'result': ..., 'payload': ...} or None if not found.
+    Fetch the status, result, result_hash and partial_result JSON for a given request_id from the state-db.requests table.
+    Returns a dict like {'status': ..., 'result': ..., 'result_hash': ..., 'partial_result': ...} or None if not found.
+    `result` is left out (None) when its hash is in `known_hashes`, i.e. the client already has it.
     """
-    with psycopg2.connect(STATE_DB_URL) as conn:
+    with get_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
-                "SELECT status, user_id, result, payload FROM requests WHERE request_id = %s",
-                (request_id,),
+                """
+                SELECT status, result_hash, partial_result,
+                       CASE WHEN result_hash = ANY(%s) THEN NULL ELSE result END AS result
+                  FROM requests
+                 WHERE request_id = %s
+                """,
+                (list(known_hashes), request_id),
             )
             return cur.fetchone()  # None if no row, or {'status':..., 'result':...}
 
 
-def insert_request(request_id, user_id, payload):
+def insert_request(request_id, user_id, payload, fingerprint=None, leader_request_id=None):
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
-                INSERT INTO requests (request_id, user_id, status, payload)
-                VALUES (%s, %s, %s, %s)
+                INSERT INTO requests (request_id, user_id, status, payload, fingerprint, leader_request_id)
+                VALUES (%s, %s, %s, %s, %s, %s)
             """,
-                (request_id, user_id, "pending", payload),
+                (request_id, user_id, "pending", payload, fingerprint, leader_request_id),
             )
 
 
-def clear_response(request_id):
+def insert_or_join_request(request_id, user_id, payload, fingerprint, window_seconds):
+    """
+    Insert a pending request, attaching it to an identical in-flight leader
+    when one was submitted within `window_seconds`.
+    Returns the leader's request_id if joined, or None if this request leads.
+
+    The per-fingerprint advisory lock is also taken by whoever completes or
+    fails the leader, so a follower can never attach after its leader's result
+    has been written.
+    """
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("DELETE FROM requests WHERE request_id = %s", (request_id,))
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (fingerprint,))
+            cur.execute(
+                """
+                SELECT request_id
+                  FROM requests
+                 WHERE fingerprint = %s
+                   AND status = 'pending'
+                   AND leader_request_id IS NULL
+                   AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                 ORDER BY created_at
+                 LIMIT 1
+                """,
+                (fingerprint, window_seconds),
+            )
+            row = cur.fetchone()
+            leader_request_id = str(row[0]) if row else None
+            cur.execute(
+                """
+                INSERT INTO requests (request_id, user_id, status, payload, fingerprint, leader_request_id)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                """,
+                (request_id, user_id, "pending", payload, fingerprint, leader_request_id),
+            )
+            return leader_request_id
 
 
-def insert_user(username, password):
-    hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+def mark_request_failed(request_id, reason):
+    """Fail a pending request together with any requests coalesced onto it."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT pg_advisory_xact_lock(hashtext(fingerprint))
+                  FROM requests
+                 WHERE request_id = %s AND fingerprint IS NOT NULL
+                """,
+                (request_id,),
+            )
+            cur.execute(
+                """
+                UPDATE requests
+                   SET status = 'error',
+                       result = %s
+                 WHERE (request_id = %s OR leader_request_id = %s)
+                   AND status = 'pending'
+                """,
+                (psycopg2.extras.Json({"error": reason}), request_id, request_id),
+            )
+
+
+def insert_user(username, password_hash):
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
@@ -49,7 +110,7 @@ def insert_user(username, password):
                 INSERT INTO users (username, password_hash)
                 VALUES (%s, %s)
                 """,
-                (username, hashed.decode("utf-8")),
+                (username, password_hash),
             )
 
 
@@ -80,15 +141,19 @@ def save_trip_to_history(user_id, trip_data, parsed):
     raw_plan = parsed
 
     if not destination or not start_date or not end_date:
-        print("Trip data missing required fields:", trip_data)
+        log.warning("Trip data missing required fields", extra={"trip": trip_data})
         return
 
+    fingerprint = trip_fingerprint(
+        destination, start_date, end_date, interests, by_dates=True
+    )
+
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
-                INSERT INTO trips (user_id, destination, start_date, end_date, interests, raw_plan)
-                VALUES (%s, %s, %s, %s, %s, %s)
+                INSERT INTO trips (user_id, destination, start_date, end_date, interests, raw_plan, fingerprint, plan_hash)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 RETURNING trip_id
                 """,
                 (
@@ -98,6 +163,8 @@ def save_trip_to_history(user_id, trip_data, parsed):
                     end_date,
                     psycopg2.extras.Json(interests),
                     psycopg2.extras.Json(raw_plan),
+                    fingerprint,
+                    content_hash(raw_plan),
                 ),
             )
             trip_id = cur.fetchone()[0]
@@ -108,48 +175,131 @@ def save_trip_to_history(user_id, trip_data, parsed):
                 """,
                 (user_id, trip_id),
             )
-        conn.commit()
 
 
-def get_user_history(user_id):
+_HISTORY_SUMMARY_COLUMNS = """
+    h.history_id, h.saved_at, t.trip_id, t.destination,
+    t.start_date, t.end_date, t.interests
+"""
+
+
+def get_user_history(user_id, limit, before=None):
+    """
+    One page of a user's history, newest first, as lightweight summaries
+    (no raw_plan). `before` is the (saved_at, history_id) of the last row of
+    the previous page; pagination is keyset-based so every page costs the same.
+    """
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            if before is None:
+                cur.execute(
+                    f"""
+                    SELECT {_HISTORY_SUMMARY_COLUMNS}
+                    FROM history h
+                    JOIN trips t ON t.trip_id = h.trip_id
+                    WHERE h.user_id = %s
+                    ORDER BY h.saved_at DESC, h.history_id DESC
+                    LIMIT %s
+                    """,
+                    (user_id, limit),
+                )
+            else:
+                cur.execute(
+                    f"""
+                    SELECT {_HISTORY_SUMMARY_COLUMNS}
+                    FROM history h
+                    JOIN trips t ON t.trip_id = h.trip_id
+                    WHERE h.user_id = %s
+                      AND (h.saved_at, h.history_id) < (%s, %s)
+                    ORDER BY h.saved_at DESC, h.history_id DESC
+                    LIMIT %s
+                    """,
+                    (user_id, before[0], before[1], limit),
+                )
+            return cur.fetchall()
+
+
+def get_user_trip(user_id, trip_id, known_hashes=()):
+    """
+    Full trip, including raw_plan and plan_hash, if it belongs to `user_id`.
+    raw_plan is left out (None) when plan_hash is in `known_hashes`.
+    """
     with get_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
                 """
-                SELECT t.*
-                FROM trips t
-                JOIN history h ON t.trip_id = h.trip_id
-                WHERE h.user_id = %s
-                ORDER BY h.saved_at DESC
-            """,
-                (user_id,),
+                SELECT trip_id, destination, start_date, end_date, interests, plan_hash,
+                       CASE WHEN plan_hash = ANY(%s) THEN NULL ELSE raw_plan END AS raw_plan
+                FROM trips
+                WHERE trip_id = %s AND user_id = %s
+                """,
+                (list(known_hashes), trip_id, user_id),
             )
-            return cur.fetchall()
+            return cur.fetchone()
 
 
 def find_existing_trip(user_id, start_location, start_date, end_date, interests):
+    """
+    Latest plan this user saved for the same trip, matched on the indexed
+    (user_id, fingerprint) pair rather than column-by-column equality.
+    """
+    fingerprint = trip_fingerprint(
+        start_location, start_date, end_date, interests, by_dates=True
+    )
     with get_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
                 """
                 SELECT t.raw_plan
                 FROM trips t
-                JOIN history h ON t.trip_id = h.trip_id
-                WHERE h.user_id = %s
-                  AND t.destination = %s
-                  AND t.start_date = %s
-                  AND t.end_date = %s
-                  AND t.interests = %s
-                ORDER BY h.saved_at DESC
+                WHERE t.user_id = %s
+                  AND t.fingerprint = %s
+                ORDER BY t.created_at DESC
                 LIMIT 1
                 """,
-                (
-                    user_id,
-                    start_location,
-                    start_date,
-                    end_date,
-                    psycopg2.extras.Json(interests),
-                ),
+                (user_id, fingerprint),
             )
             row = cur.fetchone()
             return row["raw_plan"] if row else None
+
+
+def get_cached_plan(fingerprint, ttl_seconds):
+    """
+    Look up a plan in the cross-user cache, counting the hit.
+    Returns the plan dict, or None if absent or older than `ttl_seconds`.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE plan_cache
+                   SET hit_count = hit_count + 1,
+                       last_used_at = CURRENT_TIMESTAMP
+                 WHERE fingerprint = %s
+                   AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                RETURNING plan
+                """,
+                (fingerprint, ttl_seconds),
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+
+
+def get_route_detail(route_key):
+    """
+    Full Directions response stored by the worker for a compact route,
+    marking it used so the worker's pruning keeps it.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE route_details
+                   SET last_used_at = CURRENT_TIMESTAMP
+                 WHERE route_key = %s
+                RETURNING directions
+                """,
+                (route_key,),
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
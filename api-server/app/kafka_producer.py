@@ -1,16 +1,171 @@
 from kafka import KafkaProducer
+from kafka.admin import KafkaAdminClient, NewPartitions, NewTopic
+from kafka.errors import TopicAlreadyExistsError
 import json
+import threading
 from shared.config import KAFKA_BOOTSTRAP_SERVERS
+from shared.logs import get_logger
+from app.config import (
+    KAFKA_LINGER_MS,
+    KAFKA_BATCH_SIZE,
+    KAFKA_COMPRESSION_TYPE,
+    KAFKA_ACKS,
+    KAFKA_CLOSE_TIMEOUT_SECONDS,
+    KAFKA_MAX_BLOCK_MS,
+    KAFKA_TOPIC_PARTITIONS,
+    KAFKA_TOPIC_REPLICATION_FACTOR,
+)
+
+log = get_logger(__name__)
+
+# One producer per application lifecycle; see start_producer/close_producer.
+_producer = None
+_stop_connecting = threading.Event()
+
+
+class ProducerUnavailable(Exception):
+    """send_to_kafka could not queue a message: not connected, or send() failed."""
+
+
+def _acks(value: str):
+    return "all" if value == "all" else int(value)
 
 
 def get_producer():
     return KafkaProducer(
         bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
         value_serializer=lambda m: json.dumps(m).encode("utf-8"),
+        key_serializer=lambda k: None if k is None else k.encode("utf-8"),
+        linger_ms=KAFKA_LINGER_MS,
+        batch_size=KAFKA_BATCH_SIZE,
+        compression_type=KAFKA_COMPRESSION_TYPE,
+        acks=_acks(KAFKA_ACKS),
+        max_block_ms=KAFKA_MAX_BLOCK_MS,
+    )
+
+
+def ensure_topic(topic: str, partitions: int = KAFKA_TOPIC_PARTITIONS):
+    """
+    Create `topic` with `partitions` partitions, or grow it if it has fewer
+    (e.g. when it was auto-created with the broker default of one). Growing
+    moves some keys to new partitions, which only matters for messages
+    already queued.
+    """
+    admin = KafkaAdminClient(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
+    try:
+        try:
+            admin.create_topics(
+                [NewTopic(topic, partitions, KAFKA_TOPIC_REPLICATION_FACTOR)]
+            )
+            log.info("[Kafka] Created %s with %d partitions", topic, partitions)
+            return
+        except TopicAlreadyExistsError:
+            pass
+        metadata = admin.describe_topics([topic])[0]
+        current = len(metadata["partitions"])
+        if current < partitions:
+            admin.create_partitions({topic: NewPartitions(partitions)})
+            log.info(
+                "[Kafka] Grew %s from %d to %d partitions", topic, current, partitions
+            )
+    finally:
+        admin.close()
+
+
+def start_producer():
+    global _producer
+    if _producer is None:
+        _producer = get_producer()
+    return _producer
+
+
+def connect_in_background(topics=(), delay: float = 5):
+    """
+    Start the producer and ensure `topics` on a daemon thread, retrying every
+    `delay` seconds until Kafka is reachable. The API starts and serves
+    login, history and status without Kafka; only /submit fails until then.
+    """
+
+    def connect():
+        attempt = 0
+        while not _stop_connecting.is_set():
+            try:
+                start_producer()
+                break
+            except Exception as e:
+                attempt += 1
+                log.warning(
+                    "[Kafka] No brokers available, retrying (%d)",
+                    attempt,
+                    extra={"error": str(e)},
+                )
+                _stop_connecting.wait(delay)
+        else:
+            return
+        log.info("[Kafka] Producer connected")
+        for topic in topics:
+            try:
+                ensure_topic(topic)
+                # fetch metadata now so the first send() does not block on it
+                _producer.partitions_for(topic)
+            except Exception as e:
+                # not fatal: the broker auto-creates topics, just with fewer partitions
+                log.warning(
+                    "[Kafka] Could not ensure topic partitions",
+                    extra={"topic": topic, "error": str(e)},
+                )
+
+    _stop_connecting.clear()
+    threading.Thread(target=connect, name="kafka-connect", daemon=True).start()
+
+
+def close_producer():
+    global _producer
+    _stop_connecting.set()
+    if _producer is not None:
+        # close() flushes anything still lingering in the batch buffers
+        _producer.close(timeout=KAFKA_CLOSE_TIMEOUT_SECONDS)
+        _producer = None
+
+
+def _log_delivery(topic, metadata):
+    log.debug(
+        "[Kafka] Delivered to %s[%d] @ offset %d",
+        topic,
+        metadata.partition,
+        metadata.offset,
     )
 
 
-def send_to_kafka(topic: str, message: dict):
-    producer = get_producer()
-    producer.send(topic, message)
-    producer.flush()
+def _handle_failure(topic, on_error, exc):
+    log.error("[Kafka] Delivery to %s failed", topic, extra={"error": str(exc)})
+    if on_error is not None:
+        on_error(exc)
+
+
+def send_to_kafka(topic: str, message: dict, on_error=None, key: str = None):
+    """
+    Queue `message` on the shared producer and return immediately. Messages
+    with the same `key` land on the same partition, in order; without a key
+    they are spread across partitions.
+    Delivery is reported asynchronously from the producer's I/O thread:
+    successes are logged, failures are logged and passed to `on_error`.
+
+    Raises ProducerUnavailable (after passing it to `on_error`) if the
+    producer has not connected yet, or if send() itself fails, e.g. when
+    metadata or buffer space is not available within KAFKA_MAX_BLOCK_MS.
+    """
+    producer = _producer
+    if producer is None:
+        exc = ProducerUnavailable("Kafka producer is not connected yet")
+        _handle_failure(topic, on_error, exc)
+        raise exc
+    try:
+        future = producer.send(topic, message, key=key)
+    except Exception as e:
+        exc = ProducerUnavailable(f"Kafka send failed: {e}")
+        _handle_failure(topic, on_error, exc)
+        raise exc from e
+    future.add_callback(_log_delivery, topic)
+    future.add_errback(_handle_failure, topic, on_error)
+    return future
@@ -1,8 +1,48 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from app.routes import router
+from app.db_pool import close_pool
+from app.kafka_producer import connect_in_background, close_producer
+from shared.config import KAFKA_TOPIC, KAFKA_TOPIC_LONG
+from app import async_db, passwords
+from app.notifications import notifier
+from app.migrations import apply_migrations
+from app.config import (
+    RUN_MIGRATIONS,
+    COMPRESSION_MIN_SIZE,
+    METRICS_ENABLED,
+)
+from shared.logs import configure_logging, stop_logging
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # brotli is optional; gzip alone still covers every browser
+    BrotliMiddleware = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_logging("api-server")
+    if RUN_MIGRATIONS:
+        apply_migrations()
+    connect_in_background(
+        [KAFKA_TOPIC] + ([KAFKA_TOPIC_LONG] if KAFKA_TOPIC_LONG else [])
+    )
+    notifier.start(asyncio.get_running_loop())
+    yield
+    notifier.stop()
+    close_producer()
+    passwords.shutdown()
+    async_db.shutdown()
+    close_pool()
+    stop_logging()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # === ADD THIS CORS BLOCK ===
 app.add_middleware(
@@ -14,4 +54,22 @@ app.add_middleware(
 )
 # ============================
 
+if BrotliMiddleware is not None:
+    # negotiates br, falling back to gzip for clients that do not accept it
+    app.add_middleware(
+        BrotliMiddleware,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        gzip_fallback=True,
+        excluded_handlers=[r"^/events/"],
+    )
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+if METRICS_ENABLED:
+    from app.metrics import MetricsMiddleware, metrics_endpoint
+
+    # added last, so it wraps compression and times the full response
+    app.add_middleware(MetricsMiddleware)
+    app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 app.include_router(router)
@@ -0,0 +1,85 @@
+import time
+
+from fastapi.responses import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from app.db_pool import get_pool_stats
+from app.notifications import notifier
+
+REQUEST_SECONDS = Histogram(
+    "api_request_duration_seconds",
+    "Time to the last response byte, by route template.",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+
+class MetricsMiddleware:
+    """
+    Records REQUEST_SECONDS for every HTTP request. Plain ASGI rather than
+    BaseHTTPMiddleware so streaming responses are not buffered. Routes are
+    labelled by their template (/status/{request_id}), keeping cardinality
+    bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status_code),
+            ).observe(time.perf_counter() - started)
+
+
+class _StateCollector:
+    """Pool and notifier state, read only when Prometheus scrapes."""
+
+    def collect(self):
+        stats = get_pool_stats()
+        for key in ("checkouts", "waits", "exhausted", "health_check_failures"):
+            counter = CounterMetricFamily(
+                f"api_db_pool_{key}", f"DB pool {key.replace('_', ' ')}."
+            )
+            counter.add_metric([], stats[key])
+            yield counter
+        for key in ("in_use", "max_size"):
+            gauge = GaugeMetricFamily(
+                f"api_db_pool_{key}", f"DB pool connections ({key.replace('_', ' ')})."
+            )
+            gauge.add_metric([], stats[key])
+            yield gauge
+        listening = GaugeMetricFamily(
+            "api_notifier_listening", "1 while the LISTEN connection is up."
+        )
+        listening.add_metric([], 1 if notifier.listening else 0)
+        yield listening
+
+
+REGISTRY.register(_StateCollector())
+
+
+async def metrics_endpoint():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,119 @@
+"""
+Minimal versioned migrations for the state DB.
+
+Files in MIGRATIONS_DIR are named `NNNN_description.sql` and applied in order,
+each in its own transaction, recording NNNN in schema_migrations. Replicas
+starting together serialize on an advisory lock.
+"""
+
+import os
+import re
+
+import psycopg2
+import psycopg2.extras
+
+from app.config import STATE_DB_URL, MIGRATIONS_DIR
+from shared.fingerprint import trip_fingerprint
+from shared.logs import get_logger
+
+log = get_logger(__name__)
+
+_MIGRATION_FILE = re.compile(r"^(\d{4})_[\w-]+\.sql$")
+_MIGRATIONS_LOCK_ID = 724_101  # arbitrary, only has to be stable
+_BACKFILL_BATCH_SIZE = 1000
+
+
+def pending_migrations(directory: str, applied: set) -> list:
+    """Sorted [(version, path)] for migration files not yet applied."""
+    found = []
+    for name in os.listdir(directory):
+        match = _MIGRATION_FILE.match(name)
+        if match and match.group(1) not in applied:
+            found.append((match.group(1), os.path.join(directory, name)))
+    return sorted(found)
+
+
+def backfill_trip_fingerprints(conn):
+    """
+    Fill trips.fingerprint for rows written before the column existed. Runs
+    once, as part of migration 0004; new rows always get a fingerprint.
+    """
+    total = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT trip_id, destination, start_date, end_date, interests
+                  FROM trips
+                 WHERE fingerprint IS NULL
+                 LIMIT %s
+                """,
+                (_BACKFILL_BATCH_SIZE,),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            psycopg2.extras.execute_batch(
+                cur,
+                "UPDATE trips SET fingerprint = %s WHERE trip_id = %s",
+                [
+                    (
+                        trip_fingerprint(
+                            destination, start_date, end_date, interests, by_dates=True
+                        ),
+                        trip_id,
+                    )
+                    for trip_id, destination, start_date, end_date, interests in rows
+                ],
+            )
+        conn.commit()
+        total += len(rows)
+    if total:
+        log.info("[Migrations] Backfilled fingerprints for %d trips", total)
+
+
+# Data steps run after a version's SQL and before it is recorded as applied
+_POST_MIGRATION = {
+    "0004": backfill_trip_fingerprints,
+}
+
+
+def apply_migrations(dsn: str = STATE_DB_URL, directory: str = MIGRATIONS_DIR):
+    if not os.path.isdir(directory):
+        log.warning("[Migrations] %s not found, skipping", directory)
+        return
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (_MIGRATIONS_LOCK_ID,))
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version TEXT PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
+            cur.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cur.fetchall()}
+        conn.commit()
+
+        for version, path in pending_migrations(directory, applied):
+            with open(path) as f:
+                sql = f.read()
+            with conn.cursor() as cur:
+                cur.execute(sql)
+            if version in _POST_MIGRATION:
+                _POST_MIGRATION[version](conn)
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO schema_migrations (version) VALUES (%s)", (version,)
+                )
+            conn.commit()
+            log.info("[Migrations] Applied %s", os.path.basename(path))
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (_MIGRATIONS_LOCK_ID,))
+        conn.commit()
+        conn.close()
@@ -0,0 +1,106 @@
+"""
+Fan-out of Postgres NOTIFY events to waiting requests.
+
+One background thread per process LISTENs on a dedicated connection; each
+notification wakes every asyncio waiter subscribed to that request_id, so
+long-poll and SSE clients hold no database connection while they wait.
+"""
+
+import asyncio
+import select
+import threading
+import time
+
+import psycopg2
+
+from app.config import STATE_DB_URL, NOTIFY_CHANNEL
+from shared.logs import get_logger
+
+log = get_logger(__name__)
+
+RECONNECT_DELAY_SECONDS = 2
+
+
+class RequestNotifier:
+    def __init__(self, dsn: str, channel: str):
+        self.dsn = dsn
+        self.channel = channel
+        self.listening = False
+        self._loop = None
+        self._waiters = {}  # request_id -> set of asyncio.Event (loop thread only)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._thread = threading.Thread(
+            target=self._run, name="request-notifier", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def subscribe(self, request_id: str) -> asyncio.Event:
+        """
+        Register interest in `request_id`. Subscribe *before* reading the row,
+        so an update landing between the read and the wait is not missed.
+        """
+        event = asyncio.Event()
+        self._waiters.setdefault(request_id, set()).add(event)
+        return event
+
+    def unsubscribe(self, request_id: str, event: asyncio.Event):
+        waiters = self._waiters.get(request_id)
+        if waiters is not None:
+            waiters.discard(event)
+            if not waiters:
+                del self._waiters[request_id]
+
+    def _dispatch(self, request_id: str):
+        for event in self._waiters.pop(request_id, ()):
+            event.set()
+
+    def _dispatch_all(self):
+        # After a reconnect notifications may have been lost; make everyone re-read
+        for request_id in list(self._waiters):
+            self._dispatch(request_id)
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_session(autocommit=True)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                self.listening = True
+                self._loop.call_soon_threadsafe(self._dispatch_all)
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._loop.call_soon_threadsafe(self._dispatch, notify.payload)
+            except (psycopg2.Error, OSError) as e:
+                log.warning("[Notify] LISTEN connection lost", extra={"error": str(e)})
+                time.sleep(RECONNECT_DELAY_SECONDS)
+            finally:
+                self.listening = False
+                if conn is not None:
+                    conn.close()
+
+
+notifier = RequestNotifier(STATE_DB_URL, NOTIFY_CHANNEL)
+
+
+async def wait_for_update(event: asyncio.Event, timeout: float) -> bool:
+    """True if an update arrived within `timeout` seconds."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
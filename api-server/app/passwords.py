@@ -0,0 +1,37 @@
+"""
+bcrypt is deliberately slow; hashing and checking run on a small dedicated
+pool so a burst of logins cannot starve the event loop or the DB threads.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from app.config import BCRYPT_EXECUTOR_WORKERS
+
+_executor = ThreadPoolExecutor(
+    max_workers=BCRYPT_EXECUTOR_WORKERS, thread_name_prefix="bcrypt"
+)
+
+
+def _hash(password: str) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+
+def _check(password: str, password_hash: str) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _check, password, password_hash)
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
@@ -1,27 +1,50 @@
-from fastapi import APIRouter, HTTPException, Request, Depends, status
+from fastapi import APIRouter, HTTPException, Request, Depends, Query, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi import BackgroundTasks
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 from datetime import datetime, timedelta
-from typing import List
-from app.kafka_producer import send_to_kafka
-from app.db_queries import (
+from typing import List, Optional
+from app.kafka_producer import ProducerUnavailable, send_to_kafka
+from app.async_db import (
     insert_request,
-    clear_response,
+    insert_or_join_request,
     get_request_by_id,
     insert_user,
     get_user_by_username,
     save_trip_to_history,
     get_user_id_by_username,
     get_user_history,
+    get_user_trip,
     find_existing_trip,
+    get_cached_plan,
+    get_route_detail,
+    run_db_in_background,
 )
+from app import db_queries
+from app.passwords import hash_password, verify_password
+from app.notifications import notifier, wait_for_update
+from app.user_cache import user_id_cache
 from pydantic import BaseModel, Field
-from shared.config import KAFKA_TOPIC
-from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from shared.config import KAFKA_TOPIC, KAFKA_TOPIC_LONG
+from shared.fingerprint import trip_fingerprint, content_hash
+from app.config import (
+    SECRET_KEY,
+    ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    PLAN_CACHE_ENABLED,
+    PLAN_CACHE_TTL_SECONDS,
+    COALESCE_ENABLED,
+    COALESCE_WINDOW_SECONDS,
+    STATUS_LONG_POLL_MAX_SECONDS,
+    SSE_KEEPALIVE_SECONDS,
+    KAFKA_PARTITION_KEY,
+    LONG_TRIP_MIN_COST,
+)
 from jose import JWTError, jwt
+import base64
 import json
 import uuid
-import bcrypt
 
 
 router = APIRouter()
@@ -37,12 +60,14 @@ class TripRequest(BaseModel):
     start_date: str
     end_date: str
     interests: List[str] = Field(default_factory=list)
+    # set to False to always get a freshly generated plan
+    use_plan_cache: bool = True
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+def _decode_token(token: str) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -50,23 +75,47 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        return username
     except JWTError:
         raise credentials_exception
+    if payload.get("sub") is None:
+        raise credentials_exception
+    return payload
+
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    return _decode_token(token)["sub"]
+
+
+async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+    """
+    The caller's user_id, taken from the signed `user_id` claim. Tokens issued
+    before that claim existed fall back to a cached username lookup.
+    """
+    payload = _decode_token(token)
+    user_id = payload.get("user_id")
+    if user_id is not None:
+        return int(user_id)
+
+    username = payload["sub"]
+    user_id = user_id_cache.get(username)
+    if user_id is None:
+        user_id = await get_user_id_by_username(username)
+        if user_id is None:
+            raise HTTPException(status_code=400, detail="User not found")
+        user_id_cache.set(username, user_id)
+    return user_id
 
 
 @router.post("/submit")
-async def submit_trip(trip: TripRequest, current_user: str = Depends(get_current_user)):
+async def submit_trip(
+    trip: TripRequest,
+    background_tasks: BackgroundTasks,
+    user_id: int = Depends(get_current_user_id),
+):
     request_id = str(uuid.uuid4())
-    user_id = get_user_id_by_username(current_user)
-    if user_id is None:
-        raise HTTPException(status_code=400, detail="User not found")
 
     # Check for existing trip in user's history
-    existing_trip = find_existing_trip(
+    existing_trip = await find_existing_trip(
         user_id,
         trip.start_location,
         trip.start_date,
@@ -81,52 +130,224 @@ async def submit_trip(trip: TripRequest, current_user: str = Depends(get_current
             "message": "Trip already exists in your history.",
         }
 
+    # Someone else may already have planned an equivalent trip
+    if PLAN_CACHE_ENABLED and trip.use_plan_cache:
+        fingerprint = trip_fingerprint(
+            trip.start_location, trip.start_date, trip.end_date, trip.interests
+        )
+        cached_plan = await get_cached_plan(fingerprint, PLAN_CACHE_TTL_SECONDS)
+        if cached_plan:
+            background_tasks.add_task(
+                save_trip_to_history,
+                user_id=user_id,
+                trip_data=trip.model_dump(),
+                parsed=cached_plan,
+            )
+            return {
+                "status": "done",
+                "trip": cached_plan,
+                "message": "Trip planned from a matching itinerary.",
+            }
+
     # No existing trip, proceed as normal
-    insert_request(request_id, user_id, trip.model_dump_json())
+    strict_fingerprint = trip_fingerprint(
+        trip.start_location,
+        trip.start_date,
+        trip.end_date,
+        trip.interests,
+        by_dates=True,
+    )
+    if COALESCE_ENABLED:
+        leader_request_id = await insert_or_join_request(
+            request_id,
+            user_id,
+            trip.model_dump_json(),
+            strict_fingerprint,
+            COALESCE_WINDOW_SECONDS,
+        )
+        if leader_request_id:
+            # An identical trip is already being planned; this request gets
+            # its result when the leader finishes, without a Kafka message.
+            return {
+                "status": "submitted",
+                "request_id": request_id,
+            }
+    else:
+        await insert_request(request_id, user_id, trip.model_dump_json())
 
     payload = {
         "request_id": request_id,
         "user_id": user_id,
         **trip.model_dump(),
     }
-    send_to_kafka(KAFKA_TOPIC, payload)
+    try:
+        send_to_kafka(
+            _lane_topic(trip),
+            payload,
+            on_error=lambda exc: run_db_in_background(
+                db_queries.mark_request_failed, request_id, f"Queueing failed: {exc}"
+            ),
+            key=_partition_key(user_id, strict_fingerprint),
+        )
+    except ProducerUnavailable:
+        # on_error already failed the request row
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Trip planning is temporarily unavailable, please retry shortly",
+        )
     return {
         "status": "submitted",
         "request_id": request_id,
     }
 
 
+def _estimated_cost(trip: TripRequest) -> float:
+    """
+    Rough cost of planning `trip` in day-equivalents: generation time and
+    photo lookups grow with the number of days, the prompt with interests.
+    """
+    try:
+        days = (
+            datetime.fromisoformat(trip.end_date) - datetime.fromisoformat(trip.start_date)
+        ).days + 1
+    except ValueError:
+        days = 1  # the worker reports the bad dates
+    return max(1, days) + len(trip.interests) / 2
+
+
+def _lane_topic(trip: TripRequest) -> str:
+    """Long trips get their own topic so short ones never wait behind them."""
+    if KAFKA_TOPIC_LONG and _estimated_cost(trip) >= LONG_TRIP_MIN_COST:
+        return KAFKA_TOPIC_LONG
+    return KAFKA_TOPIC
+
+
+def _partition_key(user_id: int, fingerprint: str):
+    """
+    Kafka key for a trip request. By user keeps each user's requests in
+    order on one partition of their lane's topic (a short trip may still
+    overtake an earlier long one); by fingerprint sends identical trips to
+    the same consumer, whose route and photo caches are then already warm.
+    """
+    if KAFKA_PARTITION_KEY == "user_id":
+        return str(user_id)
+    if KAFKA_PARTITION_KEY == "fingerprint":
+        return fingerprint
+    return None
+
+
+def _load_json(value):
+    return value if isinstance(value, (dict, list)) or value is None else json.loads(value)
+
+
+def _status_body(row) -> dict:
+    """Response body for a requests row; a done request returns its plan."""
+    if row["status"] != "done":
+        if row["partial_result"]:
+            # days generated so far; photos are filled in once the plan is done
+            return {"status": row["status"], "partial": row["partial_result"]}
+        return {"status": row["status"]}
+    return _load_json(row["result"])
+
+
+def _client_etags(request: Request) -> list:
+    """Hashes from If-None-Match (quotes and weak prefixes stripped)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return []
+    return [
+        tag.strip().removeprefix("W/").strip('"') for tag in header.split(",")
+    ]
+
+
+def _etag(content_hash: str) -> str:
+    return f'"{content_hash}"'
+
+
+async def _read_request(request_id: str, wait: float, known_hashes=()):
+    """
+    Read a request row. With `wait` > 0 a pending row is held until the worker
+    updates it (NOTIFY) or `wait` seconds pass, then read again.
+    """
+    if wait <= 0:
+        return await get_request_by_id(request_id, known_hashes)
+    event = notifier.subscribe(request_id)
+    try:
+        row = await get_request_by_id(request_id, known_hashes)
+        if row and row["status"] == "pending":
+            if await wait_for_update(event, min(wait, STATUS_LONG_POLL_MAX_SECONDS)):
+                row = await get_request_by_id(request_id, known_hashes)
+        return row
+    finally:
+        notifier.unsubscribe(request_id, event)
+
+
 @router.get("/status/{request_id}")
-async def get_status(request_id: str, background_tasks: BackgroundTasks):
-    row = get_request_by_id(request_id)
+async def get_status(
+    request_id: str, request: Request, response: Response, wait: float = 0
+):
+    """
+    Done plans carry an ETag; a client sending it back in If-None-Match gets
+    a bodiless 304 and the plan is not even read from the database.
+    """
+    known_hashes = _client_etags(request)
+    row = await _read_request(request_id, wait, known_hashes)
     if not row:
         raise HTTPException(404)
-    if row["status"] != "done":
-        return {"status": row["status"]}
-    result = row["result"]
-    parsed = result if isinstance(result, dict) else json.loads(result)
-
-    # Parse payload JSON string to dict
-    trip_request = row["payload"]
-    if isinstance(trip_request, str):
-        trip_request = json.loads(trip_request)
-
-    background_tasks.add_task(
-        save_trip_to_history,
-        user_id=row["user_id"],
-        trip_data=trip_request,
-        parsed=parsed,
-    )
-    background_tasks.add_task(clear_response, request_id)
+    if row["status"] == "done" and row["result_hash"]:
+        etag = _etag(row["result_hash"])
+        if row["result_hash"] in known_hashes:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+    return _status_body(row)
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/events/{request_id}")
+async def stream_status(request_id: str, request: Request):
+    """
+    Server-Sent Events for one request: a `status` event for every change
+    (including partial days), ending with the final plan or error.
+    """
+    if not await get_request_by_id(request_id):
+        raise HTTPException(404)
+
+    async def events():
+        last_body = None
+        while not await request.is_disconnected():
+            event = notifier.subscribe(request_id)
+            try:
+                row = await get_request_by_id(request_id)
+                if row is None:
+                    return
+                body = _status_body(row)
+                if row["status"] != "pending":
+                    yield _sse("status", body)
+                    return
+                if body != last_body:
+                    yield _sse("status", body)
+                    last_body = body
+                if not await wait_for_update(event, SSE_KEEPALIVE_SECONDS):
+                    yield ": keepalive\n\n"
+            finally:
+                notifier.unsubscribe(request_id, event)
 
-    return parsed
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.post("/signup")
 async def signup(user: UserAuth):
     if user.username and user.password:
         try:
-            insert_user(user.username, user.password)
+            password_hash = await hash_password(user.password)
+            await insert_user(user.username, password_hash)
             return {"status": "success", "message": f"User {user.username} registered"}
         except Exception as e:
             return {"status": "error", "message": "Invalid credentials"}
@@ -135,11 +356,13 @@ async def signup(user: UserAuth):
 
 @router.post("/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    db_user = get_user_by_username(form_data.username)
-    if db_user and bcrypt.checkpw(
-        form_data.password.encode("utf-8"), db_user["password_hash"].encode("utf-8")
+    db_user = await get_user_by_username(form_data.username)
+    if db_user and await verify_password(
+        form_data.password, db_user["password_hash"]
     ):
-        access_token = create_access_token(data={"sub": form_data.username})
+        access_token = create_access_token(
+            data={"sub": form_data.username, "user_id": db_user["user_id"]}
+        )
         return {
             "status": "success",
             "access_token": access_token,
@@ -149,23 +372,82 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     return {"status": "error", "message": "Invalid credentials"}
 
 
+def _encode_history_cursor(row) -> str:
+    raw = f"{row['saved_at'].isoformat()}|{row['history_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_history_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        saved_at, history_id = raw.split("|")
+        return datetime.fromisoformat(saved_at), int(history_id)
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/history")
-async def get_history(current_user: str = Depends(get_current_user)):
-    user_id = get_user_id_by_username(current_user)
-    if user_id is None:
-        raise HTTPException(status_code=400, detail="User not found")
-    history = get_user_history(user_id)
-    return {"history": history}
+async def get_history(
+    request: Request,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user_id: int = Depends(get_current_user_id),
+):
+    """
+    Trip summaries (no plans), newest first. Pass the returned `next_cursor`
+    to get the following page; it is null on the last page.
+    """
+    before = _decode_history_cursor(cursor) if cursor else None
+    rows = await get_user_history(user_id, limit + 1, before)
+    next_cursor = _encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+    body = jsonable_encoder({"history": rows[:limit], "next_cursor": next_cursor})
+
+    etag = _etag(content_hash(body))
+    if etag.strip('"') in _client_etags(request):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return body
+
+
+@router.get("/trips/{trip_id}")
+async def get_trip(
+    trip_id: int,
+    request: Request,
+    response: Response,
+    user_id: int = Depends(get_current_user_id),
+):
+    """Full saved trip, including raw_plan, loaded on demand. Supports If-None-Match."""
+    known_hashes = _client_etags(request)
+    trip = await get_user_trip(user_id, trip_id, known_hashes)
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    plan_hash = trip.pop("plan_hash")
+    if plan_hash:
+        etag = _etag(plan_hash)
+        if plan_hash in known_hashes:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+    return trip
+
+
+@router.get("/routes/{route_key}")
+async def get_route(route_key: str, user_id: int = Depends(get_current_user_id)):
+    """
+    Full Directions response (legs, steps, instructions) for a plan's compact
+    `google_route`, identified by its `detail_key`.
+    """
+    directions = await get_route_detail(route_key)
+    if directions is None:
+        raise HTTPException(status_code=404, detail="Route not found")
+    return directions
 
 
 @router.post("/find_trip")
 async def find_user_trip(
-    trip: TripRequest, current_user: str = Depends(get_current_user)
+    trip: TripRequest, user_id: int = Depends(get_current_user_id)
 ):
-    user_id = get_user_id_by_username(current_user)
-    if user_id is None:
-        raise HTTPException(status_code=400, detail="User not found")
-    raw_plan = find_existing_trip(
+    raw_plan = await find_existing_trip(
         user_id,
         trip.start_location,
         trip.start_date,
@@ -0,0 +1,36 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import USER_ID_CACHE_SIZE, USER_ID_CACHE_TTL_SECONDS
+
+
+class UserIdCache:
+    """Bounded LRU of username -> user_id with a per-entry TTL."""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # username -> (expires_at, user_id)
+        self._lock = threading.Lock()
+
+    def get(self, username: str):
+        with self._lock:
+            item = self._entries.get(username)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._entries[username]
+                return None
+            self._entries.move_to_end(username)
+            return item[1]
+
+    def set(self, username: str, user_id: int):
+        with self._lock:
+            self._entries[username] = (time.monotonic() + self.ttl_seconds, user_id)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+user_id_cache = UserIdCache(USER_ID_CACHE_SIZE, USER_ID_CACHE_TTL_SECONDS)
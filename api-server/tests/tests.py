@@ -31,6 +31,242 @@ def test_submit_and_status():
     ]  # POC might still be pending
 
 
+def _auth(user_id=7):
+    from app.routes import create_access_token
+
+    token = create_access_token({"sub": "alice", "user_id": user_id})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_identical_submission_joins_the_in_flight_leader():
+    from contextlib import contextmanager
+    from unittest.mock import AsyncMock, MagicMock, patch
+    from app import db_queries
+
+    conn = MagicMock()
+    cur = conn.cursor.return_value.__enter__.return_value
+    cur.fetchone.return_value = ("leader-1",)
+
+    @contextmanager
+    def connection():
+        yield conn
+
+    with patch("app.db_queries.get_connection", connection):
+        leader = db_queries.insert_or_join_request("r2", 7, "{}", "fp", 30)
+    assert leader == "leader-1"
+    lock, lookup, insert = cur.execute.call_args_list
+    assert lock.args[1] == ("fp",)
+    assert lookup.args[1] == ("fp", 30)
+    assert insert.args[1] == ("r2", 7, "pending", "{}", "fp", "leader-1")
+
+    # a follower is answered by the leader's result: nothing goes to Kafka
+    trip = {"start_location": "Rome", "start_date": "2025-07-01", "end_date": "2025-07-03"}
+    with patch("app.routes.get_user_id_by_username", AsyncMock(return_value=7)), \
+            patch("app.routes.find_existing_trip", AsyncMock(return_value=None)), \
+            patch("app.routes.get_cached_plan", AsyncMock(return_value=None)), \
+            patch("app.routes.insert_or_join_request", AsyncMock(return_value="leader-1")), \
+            patch("app.routes.send_to_kafka") as send:
+        resp = client.post("/submit", json=trip, headers=_auth())
+    assert resp.json()["status"] == "submitted"
+    send.assert_not_called()
+
+
+def test_history_cursor_pages_by_saved_at_and_history_id():
+    from datetime import datetime
+    from unittest.mock import AsyncMock, patch
+
+    rows = [
+        {"history_id": i, "trip_id": i, "saved_at": datetime(2025, 7, 1, 12, 0, i)}
+        for i in (5, 4, 3)
+    ]
+    with patch("app.routes.get_user_id_by_username", AsyncMock(return_value=7)), \
+            patch("app.routes.get_user_history", AsyncMock(return_value=rows)) as history:
+        first = client.get("/history?limit=2", headers=_auth())
+        assert first.status_code == 200
+        body = first.json()
+        assert [row["history_id"] for row in body["history"]] == [5, 4]
+        history.assert_awaited_with(7, 3, None)
+
+        # the cursor points at the last row returned, not at an offset
+        history.return_value = rows[2:]
+        second = client.get(
+            f"/history?limit=2&cursor={body['next_cursor']}", headers=_auth()
+        )
+        assert second.json()["next_cursor"] is None
+        history.assert_awaited_with(7, 3, (datetime(2025, 7, 1, 12, 0, 4), 4))
+
+        bad = client.get("/history?cursor=not-a-cursor", headers=_auth())
+    assert bad.status_code == 400
+
+
+def test_status_trips_and_history_answer_304_to_a_matching_etag():
+    from datetime import datetime
+    from unittest.mock import AsyncMock, patch
+
+    done = {
+        "status": "done",
+        "result_hash": "abc",
+        "partial_result": None,
+        "result": {"days": []},
+    }
+    trip = {"trip_id": 1, "destination": "Rome", "plan_hash": "def", "raw_plan": {}}
+    rows = [{"history_id": 1, "trip_id": 1, "saved_at": datetime(2025, 7, 1)}]
+    with patch("app.routes.get_request_by_id", AsyncMock(return_value=done)) as status, \
+            patch("app.routes.get_user_trip", AsyncMock(return_value=trip)) as trips, \
+            patch("app.routes.get_user_history", AsyncMock(return_value=rows)):
+        resp = client.get("/status/r1")
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] == '"abc"'
+        resp = client.get("/status/r1", headers={"If-None-Match": 'W/"abc"'})
+        assert resp.status_code == 304 and resp.content == b""
+        # the known hash is passed down so the plan is not read at all
+        status.assert_awaited_with("r1", ["abc"])
+
+        resp = client.get("/trips/1", headers={**_auth(), "If-None-Match": '"def"'})
+        assert resp.status_code == 304
+        trips.assert_awaited_with(7, 1, ["def"])
+
+        etag = client.get("/history", headers=_auth()).headers["ETag"]
+        resp = client.get("/history", headers={**_auth(), "If-None-Match": etag})
+        assert resp.status_code == 304
+
+
+def test_send_failure_fails_the_request_and_raises_producer_unavailable():
+    from unittest.mock import MagicMock, patch
+    from kafka.errors import KafkaTimeoutError
+    from app import kafka_producer
+
+    producer = MagicMock()
+    producer.send.side_effect = KafkaTimeoutError("no metadata within 500 ms")
+    failed = []
+    with patch("app.kafka_producer._producer", producer):
+        with pytest.raises(kafka_producer.ProducerUnavailable):
+            kafka_producer.send_to_kafka("trip_requests", {}, on_error=failed.append)
+    assert len(failed) == 1
+
+
+def test_strict_fingerprint_matches_however_the_dates_were_written():
+    from datetime import date
+    from shared.fingerprint import trip_fingerprint
+
+    stored = trip_fingerprint("Rome", date(2026, 1, 5), date(2026, 1, 7), [], by_dates=True)
+    assert trip_fingerprint("Rome", "2026-1-5", "2026-01-7", [], by_dates=True) == stored
+    assert trip_fingerprint("Rome", "2026-01-05", "2026-01-07", [], by_dates=True) == stored
+
+
+def test_trip_fingerprint_ignores_interest_order_and_case():
+    from shared.fingerprint import trip_fingerprint
+
+    a = trip_fingerprint("Berlin, Germany", "2025-07-01", "2025-07-03", ["Food", "history"])
+    b = trip_fingerprint(" berlin germany", "2025-07-01", "2025-07-03", ["HISTORY ", "food"])
+    assert a == b
+    assert a != trip_fingerprint("Berlin", "2025-07-01", "2025-07-03", ["food"])
+
+    # by default equal-length trips share a fingerprint; by_dates keeps them apart
+    later = trip_fingerprint("Berlin, Germany", "2025-09-10", "2025-09-12", ["food", "history"])
+    assert later == a
+    assert trip_fingerprint(
+        "Berlin, Germany", "2025-09-10", "2025-09-12", ["food", "history"], by_dates=True
+    ) != trip_fingerprint(
+        "Berlin, Germany", "2025-07-01", "2025-07-03", ["food", "history"], by_dates=True
+    )
+    assert trip_fingerprint("Berlin", "2025-07-01", "2025-07-04", []) != trip_fingerprint(
+        "Berlin", "2025-07-01", "2025-07-03", []
+    )
+
+
+def test_submit_answers_from_the_plan_cache_without_producing():
+    from unittest.mock import AsyncMock, patch
+    from shared.fingerprint import trip_fingerprint
+
+    plan = {"days": [{"morning": {"place_name": "Colosseum"}}]}
+    trip = {
+        "start_location": "Rome",
+        "start_date": "2025-07-01",
+        "end_date": "2025-07-03",
+        "interests": ["history"],
+    }
+    with patch("app.routes.find_existing_trip", AsyncMock(return_value=None)), \
+            patch("app.routes.get_cached_plan", AsyncMock(return_value=plan)) as cached, \
+            patch("app.routes.save_trip_to_history") as save, \
+            patch("app.routes.insert_or_join_request") as insert, \
+            patch("app.routes.send_to_kafka") as send:
+        resp = client.post("/submit", json=trip, headers=_auth())
+    assert resp.json()["status"] == "done"
+    assert resp.json()["trip"] == plan
+    assert cached.await_args.args[0] == trip_fingerprint(
+        "Rome", "2025-07-01", "2025-07-03", ["history"]
+    )
+    save.assert_called_once()  # copied into the user's history in the background
+    insert.assert_not_called()
+    send.assert_not_called()
+
+
+def test_user_id_comes_from_the_token_or_the_lru_for_legacy_tokens():
+    from unittest.mock import AsyncMock, patch
+    from app.routes import create_access_token
+    from app.user_cache import UserIdCache
+
+    legacy = {"Authorization": f"Bearer {create_access_token({'sub': 'bob'})}"}
+    cache = UserIdCache(max_size=1, ttl_seconds=60)
+    with patch("app.routes.user_id_cache", cache), \
+            patch("app.routes.get_user_id_by_username", AsyncMock(return_value=42)) as lookup, \
+            patch("app.routes.get_user_history", AsyncMock(return_value=[])) as history:
+        client.get("/history", headers=_auth(user_id=7))
+        history.assert_awaited_with(7, 21, None)
+        lookup.assert_not_awaited()
+
+        # tokens issued before the user_id claim: looked up once, then cached
+        client.get("/history", headers=legacy)
+        client.get("/history", headers=legacy)
+        history.assert_awaited_with(42, 21, None)
+        lookup.assert_awaited_once_with("bob")
+
+        cache.set("carol", 9)  # evicts bob from the one-entry LRU
+        client.get("/history", headers=legacy)
+        assert lookup.await_count == 2
+
+
+def test_status_long_poll_wakes_on_notify_and_times_out_pending():
+    import asyncio
+    import threading
+    import time
+    from unittest.mock import patch
+    from app.notifications import notifier
+
+    pending = {"status": "pending", "result_hash": None, "partial_result": None, "result": None}
+    done = {"status": "done", "result_hash": None, "partial_result": None, "result": {"days": []}}
+    reads = []
+
+    async def read(request_id, known_hashes=()):
+        reads.append(request_id)
+        if len(reads) > 1:
+            return done
+        # what the LISTEN thread does when the worker's NOTIFY arrives
+        loop = asyncio.get_running_loop()
+        threading.Timer(
+            0.05, loop.call_soon_threadsafe, (notifier._dispatch, request_id)
+        ).start()
+        return pending
+
+    with patch("app.routes.get_request_by_id", read):
+        started = time.monotonic()
+        resp = client.get("/status/r1?wait=10")
+        assert resp.json() == {"days": []}
+        assert time.monotonic() - started < 5
+        assert reads == ["r1", "r1"]
+
+    async def still_pending(request_id, known_hashes=()):
+        return pending
+
+    with patch("app.routes.get_request_by_id", still_pending):
+        started = time.monotonic()
+        resp = client.get("/status/r2?wait=0.2")
+        assert resp.json() == {"status": "pending"}
+        assert time.monotonic() - started >= 0.2
+    assert notifier._waiters == {}
+
+
 # import pytest
 # from fastapi.testclient import TestClient
 # from app.main import app
@@ -0,0 +1,140 @@
+"""
+In-process stand-in for Kafka, covering the slice of kafka-python that the
+api-server producer and the logic-worker consumer loop use. Messages are
+JSON round-tripped like the real serializers, so payloads that would not
+survive Kafka fail here too.
+"""
+
+import json
+import threading
+import time
+from collections import namedtuple
+
+from kafka.structs import TopicPartition
+
+RecordMetadata = namedtuple("RecordMetadata", "topic partition offset")
+ConsumerRecord = namedtuple("ConsumerRecord", "topic partition offset value")
+
+
+class _SentFuture:
+    """Delivery is immediate, so callbacks run as soon as they are added."""
+
+    def __init__(self, metadata):
+        self._metadata = metadata
+
+    def add_callback(self, fn, *args):
+        fn(*args, self._metadata)
+        return self
+
+    def add_errback(self, fn, *args):
+        return self
+
+    def get(self, timeout=None):
+        return self._metadata
+
+
+class InProcessBroker:
+    def __init__(self, partitions: int = 1):
+        self.partitions = partitions
+        self._logs = {}  # TopicPartition -> [value, ...]
+        self._cond = threading.Condition()
+        self.sent = 0
+
+    def _log(self, tp: TopicPartition) -> list:
+        return self._logs.setdefault(tp, [])
+
+    def append(self, topic: str, value, key=None) -> RecordMetadata:
+        with self._cond:
+            if key is not None:
+                partition = hash(key) % self.partitions
+            else:
+                partition = self.sent % self.partitions
+            log = self._log(TopicPartition(topic, partition))
+            log.append(json.loads(json.dumps(value)))
+            self.sent += 1
+            self._cond.notify_all()
+            return RecordMetadata(topic, partition, len(log) - 1)
+
+    def producer(self, *args, **kwargs) -> "FakeProducer":
+        return FakeProducer(self)
+
+    def consumer(self, *topics, **kwargs) -> "FakeConsumer":
+        return FakeConsumer(self, topics or ("trip_requests",))
+
+
+class FakeProducer:
+    def __init__(self, broker: InProcessBroker):
+        self._broker = broker
+
+    def send(self, topic, value=None, key=None, **kwargs):
+        return _SentFuture(self._broker.append(topic, value, key))
+
+    def partitions_for(self, topic):
+        return set(range(self._broker.partitions))
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self, timeout=None):
+        pass
+
+
+class FakeConsumer:
+    def __init__(self, broker: InProcessBroker, topics):
+        self._broker = broker
+        self._assignment = {
+            TopicPartition(topic, p)
+            for topic in topics
+            for p in range(broker.partitions)
+        }
+        self._positions = {tp: 0 for tp in self._assignment}
+        self._paused = set()
+        self.committed = {}
+
+    def assignment(self):
+        return set(self._assignment)
+
+    def paused(self):
+        return set(self._paused)
+
+    def pause(self, *partitions):
+        self._paused.update(partitions)
+
+    def resume(self, *partitions):
+        self._paused.difference_update(partitions)
+
+    def _fetch(self, max_records):
+        records = {}
+        for tp in sorted(self._assignment - self._paused):
+            log = self._broker._logs.get(tp, [])
+            position = self._positions[tp]
+            batch = log[position : position + max_records - sum(map(len, records.values()))]
+            if batch:
+                records[tp] = [
+                    ConsumerRecord(tp.topic, tp.partition, position + i, value)
+                    for i, value in enumerate(batch)
+                ]
+                self._positions[tp] = position + len(batch)
+        return records
+
+    def poll(self, timeout_ms=0, max_records=500):
+        deadline = time.monotonic() + timeout_ms / 1000
+        with self._broker._cond:
+            while True:
+                records = self._fetch(max_records)
+                remaining = deadline - time.monotonic()
+                if records or remaining <= 0:
+                    return records
+                self._broker._cond.wait(remaining)
+
+    def highwater(self, tp):
+        return len(self._broker._logs.get(tp, []))
+
+    def position(self, tp):
+        return self._positions[tp]
+
+    def commit(self, offsets=None):
+        self.committed.update({tp: meta.offset for tp, meta in (offsets or {}).items()})
+
+    def close(self, autocommit=True):
+        pass
@@ -0,0 +1,314 @@
+"""
+Local stand-ins for the OpenAI chat completions API and the Google Maps
+Directions / Places endpoints the logic-worker calls, with configurable
+latency and error rates.
+
+Run standalone to point a docker-compose stack at them:
+
+    python -m benchmarks.fakes --openai-port 8081 --google-port 8082
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class Profile:
+    """Response time ~ N(latency_ms, jitter_ms), floored at 0."""
+
+    latency_ms: float = 0
+    jitter_ms: float = 0
+    error_rate: float = 0
+    error_status: int = 500
+
+    def delay(self) -> float:
+        return max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+class _FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, handler, profile: Profile):
+        super().__init__((host, port), handler)
+        self.profile = profile
+        self.requests = Counter()
+        self.errors = Counter()
+        self._counter_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host = self.server_address[0]
+        if host in ("0.0.0.0", ""):
+            host = "127.0.0.1"
+        return f"http://{host}:{self.server_address[1]}"
+
+    def count(self, endpoint: str, failed: bool = False):
+        with self._counter_lock:
+            self.requests[endpoint] += 1
+            if failed:
+                self.errors[endpoint] += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stats(self) -> dict:
+        return {"requests": dict(self.requests), "errors": dict(self.errors)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body: dict, status: int = 200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _maybe_fail(self, endpoint: str) -> bool:
+        profile = self.server.profile
+        if profile.should_fail():
+            time.sleep(profile.delay())
+            self.server.count(endpoint, failed=True)
+            self._send_json(
+                {"error": {"message": "injected failure"}}, profile.error_status
+            )
+            return True
+        self.server.count(endpoint)
+        return False
+
+
+_TRIP_RE = re.compile(r"Plan a trip to (.+?) from (\d{4}-\d{2}-\d{2}) to (\d{4}-\d{2}-\d{2})")
+
+
+def _point(seed: str) -> dict:
+    digest = hashlib.sha1(seed.encode("utf-8")).digest()
+    return {
+        "lat": round(-60 + digest[0] / 255 * 120, 5),
+        "lng": round(-180 + digest[1] / 255 * 360, 5),
+    }
+
+
+def fake_plan(prompt: str) -> dict:
+    """A well-formed plan for the destination and dates named in `prompt`."""
+    match = _TRIP_RE.search(prompt)
+    destination, days = "Somewhere", 3
+    if match:
+        destination = match.group(1)
+        start, end = (date.fromisoformat(d) for d in match.group(2, 3))
+        days = max(1, min((end - start).days + 1, 30))
+    plan_days = []
+    for n in range(1, days + 1):
+        day = {"day": n, "summary": f"Day {n} in {destination}"}
+        for slot in ("morning", "noon", "evening"):
+            place = f"{destination} {slot} spot {n}"
+            day[slot] = {
+                "description": f"Visit {place}",
+                "place_name": place,
+                "coords": _point(place),
+                "image_url": "",
+            }
+        plan_days.append(day)
+    waypoints = [_point(f"{destination} {n}") for n in range(min(days, 4) + 1)]
+    return {"days": plan_days, "waypoints": waypoints}
+
+
+class _OpenAIHandler(_Handler):
+    CHUNK_SIZE = 64
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/v1/chat/completions":
+            return self._send_json({"error": {"message": "not found"}}, 404)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self._maybe_fail("chat.completions"):
+            return
+        prompt = " ".join(
+            m.get("content", "") for m in body.get("messages", []) if m.get("role") == "user"
+        )
+        content = json.dumps(fake_plan(prompt))
+        delay = self.server.profile.delay()
+        if body.get("stream"):
+            return self._stream(content, body.get("model", "gpt-4o-mini"), delay)
+        time.sleep(delay)
+        self._send_json(
+            {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        )
+
+    def _stream(self, content: str, model: str, delay: float):
+        """Server-sent chunks spread evenly over `delay`, like token streaming."""
+        pieces = [
+            content[i : i + self.CHUNK_SIZE]
+            for i in range(0, len(content), self.CHUNK_SIZE)
+        ]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for piece in pieces:
+            time.sleep(delay / len(pieces))
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": {"content": piece}, "finish_reason": None}
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class _GoogleHandler(_Handler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        routes = {
+            "/maps/api/directions/json": self._directions,
+            "/maps/api/place/textsearch/json": self._text_search,
+            "/maps/api/place/photo": self._photo,
+        }
+        handler = routes.get(url.path)
+        if handler is None:
+            return self._send_json({"status": "NOT_FOUND"}, 404)
+        if self._maybe_fail(url.path.rsplit("/api/", 1)[-1]):
+            return
+        time.sleep(self.server.profile.delay())
+        handler(params)
+
+    def _directions(self, params: dict):
+        stops = [params.get("origin", "")]
+        stops += [w for w in params.get("waypoints", "").split("|") if w]
+        stops.append(params.get("destination", ""))
+        legs = [
+            {
+                "distance": {"text": "1 km", "value": 1000},
+                "duration": {"text": "5 mins", "value": 300},
+                "start_address": a,
+                "end_address": b,
+                "start_location": _point(a),
+                "end_location": _point(b),
+                "steps": [
+                    {
+                        "html_instructions": f"Head from {a} to {b}",
+                        "polyline": {"points": "_p~iF~ps|U_ulLnnqC"},
+                    }
+                ],
+            }
+            for a, b in zip(stops, stops[1:])
+        ]
+        self._send_json(
+            {
+                "status": "OK",
+                "routes": [
+                    {
+                        "summary": "Benchmark route",
+                        "overview_polyline": {"points": "_p~iF~ps|U_ulLnnqC_mqNvxq`@"},
+                        "bounds": {
+                            "northeast": {"lat": 1, "lng": 1},
+                            "southwest": {"lat": 0, "lng": 0},
+                        },
+                        "legs": legs,
+                    }
+                ],
+            }
+        )
+
+    def _text_search(self, params: dict):
+        query = params.get("query", "")
+        reference = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        self._send_json(
+            {
+                "status": "OK",
+                "results": [
+                    {"name": query, "photos": [{"photo_reference": reference}]}
+                ],
+            }
+        )
+
+    def _photo(self, params: dict):
+        self.send_response(302)
+        self.send_header(
+            "Location",
+            f"{self.server.base_url}/photos/{params.get('photoreference', 'none')}.jpg",
+        )
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def start_openai(profile: Profile, port: int = 0, host: str = "127.0.0.1") -> _FakeServer:
+    return _FakeServer(host, port, _OpenAIHandler, profile).start()
+
+
+def start_google(profile: Profile, port: int = 0, host: str = "127.0.0.1") -> _FakeServer:
+    return _FakeServer(host, port, _GoogleHandler, profile).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--openai-port", type=int, default=8081)
+    parser.add_argument("--google-port", type=int, default=8082)
+    parser.add_argument("--openai-latency-ms", type=float, default=2000)
+    parser.add_argument("--openai-jitter-ms", type=float, default=500)
+    parser.add_argument("--openai-error-rate", type=float, default=0)
+    parser.add_argument("--google-latency-ms", type=float, default=80)
+    parser.add_argument("--google-jitter-ms", type=float, default=20)
+    parser.add_argument("--google-error-rate", type=float, default=0)
+    args = parser.parse_args()
+
+    openai = start_openai(
+        Profile(args.openai_latency_ms, args.openai_jitter_ms, args.openai_error_rate),
+        args.openai_port,
+        args.host,
+    )
+    google = start_google(
+        Profile(args.google_latency_ms, args.google_jitter_ms, args.google_error_rate),
+        args.google_port,
+        args.host,
+    )
+    print(f"OPENAI_BASE_URL={openai.base_url}/v1")
+    print(f"GOOGLE_MAPS_BASE_URL={google.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,29 @@ CREATE TABLE IF NOT EXISTS requests (
     status TEXT NOT NULL CHECK (status IN ('pending', 'done', 'error')),
     payload TEXT,
     result JSONB,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    -- ETag of result, see shared.fingerprint.content_hash
+    result_hash TEXT,
+    -- days generated so far while status is still 'pending'
+    partial_result JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- strict trip fingerprint; identical in-flight submissions follow one leader
+    fingerprint TEXT,
+    leader_request_id UUID
 );
 
+CREATE INDEX IF NOT EXISTS requests_pending_leader_idx
+    ON requests (fingerprint, created_at)
+    WHERE status = 'pending' AND leader_request_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS requests_leader_request_id_idx
+    ON requests (leader_request_id)
+    WHERE leader_request_id IS NOT NULL;
+
+-- Finished requests are deleted after REQUEST_RETENTION_SECONDS by the worker
+CREATE INDEX IF NOT EXISTS requests_finished_created_at_idx
+    ON requests (created_at)
+    WHERE status <> 'pending';
+
 CREATE TABLE IF NOT EXISTS users (
     user_id SERIAL PRIMARY KEY,
     username TEXT UNIQUE NOT NULL,
@@ -21,7 +41,11 @@ CREATE TABLE IF NOT EXISTS trips (
     end_date DATE NOT NULL,
     interests   JSONB    NOT NULL DEFAULT '[]',
     raw_plan JSONB,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- strict trip fingerprint, see shared.fingerprint
+    fingerprint TEXT,
+    -- ETag of raw_plan
+    plan_hash TEXT
 );
 
 CREATE TABLE IF NOT EXISTS history (
@@ -30,3 +54,66 @@ CREATE TABLE IF NOT EXISTS history (
     trip_id INTEGER REFERENCES trips(trip_id),
     saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+CREATE INDEX IF NOT EXISTS trips_user_fingerprint_idx
+    ON trips (user_id, fingerprint, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS history_user_saved_at_id_idx
+    ON history (user_id, saved_at DESC, history_id DESC) INCLUDE (trip_id);
+
+CREATE INDEX IF NOT EXISTS history_trip_id_idx ON history (trip_id);
+
+CREATE INDEX IF NOT EXISTS requests_user_id_idx ON requests (user_id);
+
+-- Plans shared across users, keyed by shared.fingerprint.trip_fingerprint
+CREATE TABLE IF NOT EXISTS plan_cache (
+    fingerprint TEXT PRIMARY KEY,
+    plan JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    hit_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS plan_cache_last_used_at_idx ON plan_cache (last_used_at);
+
+-- Full Directions responses, kept out of plans (which carry a compact route)
+CREATE TABLE IF NOT EXISTS route_details (
+    route_key TEXT PRIMARY KEY,
+    directions JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS route_details_last_used_at_idx ON route_details (last_used_at);
+
+-- Token buckets shared by every logic-worker replica (RATE_LIMIT_SHARED=true)
+CREATE TABLE IF NOT EXISTS rate_limits (
+    provider TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+
+-- Wake api-server waiters (long-poll /status, SSE /events) on request updates.
+-- The channel name is app.config.NOTIFY_CHANNEL in the api-server.
+CREATE OR REPLACE FUNCTION notify_request_update() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('request_updates', NEW.request_id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS requests_notify_update ON requests;
+CREATE TRIGGER requests_notify_update
+    AFTER UPDATE OF status, partial_result ON requests
+    FOR EACH ROW EXECUTE FUNCTION notify_request_update();
+
+-- Schema changes after this file are shipped as databases/state-db/migrations/*.sql
+-- and applied by the api-server at startup. A fresh database already has them.
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version TEXT PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO schema_migrations (version) VALUES
+    ('0001'), ('0002'), ('0003'), ('0004'), ('0005'), ('0006'), ('0007'), ('0008'), ('0009'), ('0010')
+ON CONFLICT DO NOTHING;
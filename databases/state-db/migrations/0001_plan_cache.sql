@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS plan_cache (
+    fingerprint TEXT PRIMARY KEY,
+    plan JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    hit_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS plan_cache_last_used_at_idx ON plan_cache (last_used_at);
@@ -0,0 +1,11 @@
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS partial_result JSONB;
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS fingerprint TEXT;
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS leader_request_id UUID;
+
+CREATE INDEX IF NOT EXISTS requests_pending_leader_idx
+    ON requests (fingerprint, created_at)
+    WHERE status = 'pending' AND leader_request_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS requests_leader_request_id_idx
+    ON requests (leader_request_id)
+    WHERE leader_request_id IS NOT NULL;
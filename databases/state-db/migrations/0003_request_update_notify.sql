@@ -0,0 +1,11 @@
+CREATE OR REPLACE FUNCTION notify_request_update() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('request_updates', NEW.request_id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS requests_notify_update ON requests;
+CREATE TRIGGER requests_notify_update
+    AFTER UPDATE OF status, partial_result ON requests
+    FOR EACH ROW EXECUTE FUNCTION notify_request_update();
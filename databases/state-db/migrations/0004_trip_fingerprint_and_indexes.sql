@@ -0,0 +1,13 @@
+-- Strict trip fingerprint (shared.fingerprint.trip_fingerprint(..., by_dates=True)).
+-- Existing rows are backfilled by app.migrations right after this file runs.
+ALTER TABLE trips ADD COLUMN IF NOT EXISTS fingerprint TEXT;
+
+CREATE INDEX IF NOT EXISTS trips_user_fingerprint_idx
+    ON trips (user_id, fingerprint, created_at DESC);
+
+CREATE INDEX IF NOT EXISTS history_user_saved_at_idx
+    ON history (user_id, saved_at DESC) INCLUDE (trip_id);
+
+CREATE INDEX IF NOT EXISTS history_trip_id_idx ON history (trip_id);
+
+CREATE INDEX IF NOT EXISTS requests_user_id_idx ON requests (user_id);
@@ -0,0 +1,5 @@
+-- Keyset pagination of /history orders by (saved_at, history_id)
+CREATE INDEX IF NOT EXISTS history_user_saved_at_id_idx
+    ON history (user_id, saved_at DESC, history_id DESC) INCLUDE (trip_id);
+
+DROP INDEX IF EXISTS history_user_saved_at_idx;
@@ -0,0 +1,6 @@
+-- Full Directions responses, kept out of plans (which carry a compact route)
+CREATE TABLE IF NOT EXISTS route_details (
+    route_key TEXT PRIMARY KEY,
+    directions JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
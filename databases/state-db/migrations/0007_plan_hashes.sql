@@ -0,0 +1,9 @@
+-- Stable plan hashes, served as ETags so unchanged plans can return 304.
+-- New rows get shared.fingerprint.content_hash; existing rows any stable value.
+ALTER TABLE requests ADD COLUMN IF NOT EXISTS result_hash TEXT;
+ALTER TABLE trips ADD COLUMN IF NOT EXISTS plan_hash TEXT;
+
+UPDATE requests SET result_hash = md5(result::text)
+ WHERE result_hash IS NULL AND result IS NOT NULL;
+UPDATE trips SET plan_hash = md5(raw_plan::text)
+ WHERE plan_hash IS NULL AND raw_plan IS NOT NULL;
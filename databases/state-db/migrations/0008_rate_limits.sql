@@ -0,0 +1,6 @@
+-- Token buckets shared by every logic-worker replica (RATE_LIMIT_SHARED=true)
+CREATE TABLE IF NOT EXISTS rate_limits (
+    provider TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
@@ -0,0 +1,4 @@
+-- Finished requests are deleted after REQUEST_RETENTION_SECONDS by the worker
+CREATE INDEX IF NOT EXISTS requests_finished_created_at_idx
+    ON requests (created_at)
+    WHERE status <> 'pending';
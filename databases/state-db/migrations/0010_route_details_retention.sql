@@ -0,0 +1,6 @@
+-- Route details not written or read for ROUTE_DETAILS_TTL_SECONDS are
+-- deleted by the worker
+ALTER TABLE route_details
+    ADD COLUMN IF NOT EXISTS last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS route_details_last_used_at_idx ON route_details (last_used_at);
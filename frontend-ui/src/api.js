@@ -12,8 +12,9 @@ export async function submitTrip(trip, token) {
     return res.json();
 }
 
-export async function getStatus(requestId) {
-    const res = await fetch(`${API_URL}/status/${requestId}`);
+// `wait` > 0 long-polls: the server answers as soon as the request changes
+export async function getStatus(requestId, wait = 0) {
+    const res = await fetch(`${API_URL}/status/${requestId}?wait=${wait}`);
     if (!res.ok) throw new Error("Status fetch failed");
     return res.json();
 }
@@ -49,8 +50,10 @@ export async function signup(username, password) {
     return res.json();
 }
 
-export async function getHistory(token) {
-    const res = await fetch(`${API_URL}/history`, {
+// One page of trip summaries; pass the previous page's next_cursor for more
+export async function getHistory(token, cursor = null) {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+    const res = await fetch(`${API_URL}/history${query}`, {
         headers: {
             "Authorization": "Bearer " + token
         }
@@ -58,6 +61,17 @@ export async function getHistory(token) {
     return res.json();
 }
 
+// Full saved trip (with its plan) for a history entry
+export async function getTrip(tripId, token) {
+    const res = await fetch(`${API_URL}/trips/${tripId}`, {
+        headers: {
+            "Authorization": "Bearer " + token
+        }
+    });
+    if (!res.ok) throw new Error("Trip not found");
+    return res.json();
+}
+
 export async function findUserTrip(trip, token) {
     const res = await fetch(`${API_URL}/find_trip`, {
         method: "POST",
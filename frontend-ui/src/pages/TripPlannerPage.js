@@ -1,7 +1,7 @@
 // src/pages/TripPlannerPage.js
 import React, { useState, useEffect, useRef } from 'react';
 import { MapContainer, TileLayer, Marker, Popup } from 'react-leaflet';
-import { submitTrip, getStatus, getHistory, findUserTrip } from '../api';
+import { submitTrip, getStatus, getHistory, getTrip } from '../api';
 import { Polyline, useMap } from 'react-leaflet';
 import polyline from '@mapbox/polyline';
 import { format } from "date-fns";
@@ -54,6 +54,7 @@ export default function TripPlannerPage({ user, setUser }) {
     const [open, setOpen] = useState(false);
     const ref = useRef();
     const [history, setHistory] = useState([]);
+    const [historyCursor, setHistoryCursor] = useState(null);
 
     function FitBoundsToPolyline({ points }) {
         const map = useMap();
@@ -79,29 +80,40 @@ export default function TripPlannerPage({ user, setUser }) {
         }
     }, [plan]);
 
-    // poll for status
+    // wait for status updates (long-poll: one open request at a time)
     useEffect(() => {
         if (!requestId) return;
+        let cancelled = false;
         setLoading(true);
-        const interval = setInterval(async () => {
-            try {
-                const res = await getStatus(requestId);
-                console.log("Polling getStatus response:", res);
-                if (res.status === 'done' || res.days) {
-                    clearInterval(interval);
-                    setPlan(res);
+        (async () => {
+            while (!cancelled) {
+                try {
+                    const res = await getStatus(requestId, 25);
+                    if (cancelled) return;
+                    console.log("getStatus response:", res);
+                    if (res.status === 'done' || res.days) {
+                        setPlan(res);
+                        setLoading(false);
+                        // Fetch history now, after trip is saved
+                        await refreshHistory();
+                        return;
+                    } else if (res.status === 'error') {
+                        setLoading(false);
+                        alert("Trip planning failed. Please try again.");
+                        return;
+                    } else if (res.partial) {
+                        // show the days generated so far while the rest is planned
+                        setPlan(res.partial);
+                    }
+                } catch (e) {
+                    if (cancelled) return;
                     setLoading(false);
-                    // Fetch history now, after trip is saved
-                    const historyData = await getHistory(user.token);
-                    setHistory(historyData.history || []);
+                    alert("Failed to fetch trip status. Please try again.");
+                    return;
                 }
-            } catch (e) {
-                clearInterval(interval);
-                setLoading(false);
-                alert("Failed to fetch trip status. Please try again.");
             }
-        }, 1000);
-        return () => clearInterval(interval);
+        })();
+        return () => { cancelled = true; };
     }, [requestId]);
 
     // Close dropdown if clicked outside
@@ -124,12 +136,22 @@ export default function TripPlannerPage({ user, setUser }) {
     // Fetch history on mount or when user changes
     useEffect(() => {
         if (user?.token) {
-            getHistory(user.token).then(data => {
-                setHistory(data.history || []);
-            });
+            refreshHistory();
         }
     }, [user]);
 
+    async function refreshHistory() {
+        const data = await getHistory(user.token);
+        setHistory(data.history || []);
+        setHistoryCursor(data.next_cursor || null);
+    }
+
+    async function loadMoreHistory() {
+        const data = await getHistory(user.token, historyCursor);
+        setHistory(prev => [...prev, ...(data.history || [])]);
+        setHistoryCursor(data.next_cursor || null);
+    }
+
     function toggleDarkMode() {
         setDarkMode((prev) => !prev);
         document.body.classList.toggle('dark-mode', !darkMode);
@@ -153,8 +175,7 @@ export default function TripPlannerPage({ user, setUser }) {
                 setPlan(res.trip);
                 setLoading(false);
                 // Refresh history
-                const historyData = await getHistory(user.token);
-                setHistory(historyData.history || []);
+                await refreshHistory();
             } else if (res.status === "submitted" && res.request_id) {
                 setRequestId(res.request_id);
                 // The polling effect will handle plan/history update
@@ -268,13 +289,7 @@ export default function TripPlannerPage({ user, setUser }) {
                                                 onClick={async () => {
                                                     setLoading(true);
                                                     try {
-                                                        const req = {
-                                                            start_location: trip.destination,
-                                                            start_date: trip.start_date,
-                                                            end_date: trip.end_date,
-                                                            interests: trip.interests,
-                                                        };
-                                                        const res = await findUserTrip(req, user.token);
+                                                        const res = await getTrip(trip.trip_id, user.token);
                                                         setPlan(res.raw_plan);
                                                     } catch (e) {
                                                         alert("Could not load trip details.");
@@ -290,6 +305,15 @@ export default function TripPlannerPage({ user, setUser }) {
                                                 <td>{trip.interests && trip.interests.join(", ")}</td>
                                             </tr>
                                         ))}
+                                        {historyCursor && (
+                                            <tr>
+                                                <td colSpan={3}>
+                                                    <button type="button" onClick={loadMoreHistory}>
+                                                        Load more
+                                                    </button>
+                                                </td>
+                                            </tr>
+                                        )}
                                     </tbody>
                                 </table>
                             </div>
@@ -529,13 +553,20 @@ export default function TripPlannerPage({ user, setUser }) {
                     }, [])}
 
                     {/* ✅ Big red trip route */}
-                    {plan?.google_route?.routes?.[0] && (() => {
-                        // collect _all_ steps from every leg
-                        const legs = plan.google_route.routes[0].legs || [];
-                        const allSteps = legs.flatMap(leg => leg.steps || []);
-                        const decoded = allSteps.flatMap(step =>
-                            polyline.decode(step.polyline.points)
-                        );
+                    {plan?.google_route && (() => {
+                        let decoded = [];
+                        if (plan.google_route.overview_polyline) {
+                            // compact route stored by the worker
+                            decoded = polyline.decode(plan.google_route.overview_polyline);
+                        } else if (plan.google_route.routes?.[0]) {
+                            // older trips keep the full Directions response:
+                            // collect _all_ steps from every leg
+                            const legs = plan.google_route.routes[0].legs || [];
+                            const allSteps = legs.flatMap(leg => leg.steps || []);
+                            decoded = allSteps.flatMap(step =>
+                                polyline.decode(step.polyline.points)
+                            );
+                        }
 
                         if (decoded.length > 1) {
                             return (
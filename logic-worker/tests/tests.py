@@ -1,26 +1,499 @@
+import json
+
 import pytest
 from unittest.mock import patch
 from worker.task_processor import process_task
 
 
+TASK = {
+    "request_id": "test-req-id",
+    "user_id": 1,
+    "start_location": "Berlin",
+    "start_date": "2025-07-01",
+    "end_date": "2025-07-02",
+    "interests": ["museums"],
+}
+
+
+@patch("worker.task_processor.PLAN_STREAMING_ENABLED", False)
+@patch("worker.task_processor.persist_result")
+@patch("worker.task_processor.get_google_place_photo")
+@patch("worker.task_processor.get_route_for_waypoints")
+@patch("worker.task_processor.fetch_plan_from_openai")
+def test_process_task_success(mock_openai, mock_route, mock_photo, mock_persist):
+    mock_openai.return_value = json.dumps(
+        {
+            "days": [
+                {
+                    "morning": {
+                        "description": "Museum Island",
+                        "place_name": "Pergamon Museum",
+                        "image_url": "https://upload.wikimedia.org/x.jpg",
+                    }
+                }
+            ],
+            "waypoints": [{"lat": 52.52, "lng": 13.40}, {"lat": 52.39, "lng": 13.06}],
+        }
+    )
+    mock_route.return_value = {
+        "status": "OK",
+        "routes": [{"summary": "A115", "overview_polyline": {"points": "abc"}, "legs": []}],
+    }
+    mock_photo.return_value = "https://photos.example/pergamon.jpg"
+
+    process_task(dict(TASK))
+
+    mock_persist.assert_called_once()
+    message, plan, route_detail, degraded = mock_persist.call_args[0]
+    assert message["request_id"] == "test-req-id"
+    assert plan["days"][0]["morning"]["image_url"] == "https://photos.example/pergamon.jpg"
+    assert plan["google_route"]["overview_polyline"] == "abc"
+    assert plan["google_route"]["detail_key"] == route_detail[0]
+    assert route_detail[1] == mock_route.return_value
+    assert "enrichment" not in plan
+    assert degraded == ()
+
+
+@patch("worker.task_processor.PLAN_STREAMING_ENABLED", False)
+@patch("worker.task_processor.persist_result")
+@patch("worker.task_processor.get_google_place_photo")
+@patch("worker.task_processor.get_route_for_waypoints")
 @patch("worker.task_processor.fetch_plan_from_openai")
-@patch("worker.task_processor.psycopg2.connect")
-def test_process_task_success(mock_connect, mock_openai):
-    mock_openai.return_value = '{"coordinates": ["Berlin", "Potsdam"], "days": []}'
-
-    mock_conn = mock_connect.return_value.__enter__.return_value
-    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
-
-    task = {
-        "request_id": "test-req-id",
-        "destination": "Berlin",
-        "dates": "2025-07-01 to 2025-07-05",
-        "interests": "museums, nightlife",
+def test_process_task_persists_an_error_for_invalid_json(
+    mock_openai, mock_route, mock_photo, mock_persist
+):
+    mock_openai.return_value = "Sorry, here is your trip: {days"
+
+    process_task(dict(TASK))
+
+    _message, plan, route_detail, _degraded = mock_persist.call_args[0]
+    assert plan["error"] == "Invalid JSON from OpenAI"
+    assert plan["google_route"] is None
+    assert route_detail is None
+    mock_route.assert_not_called()
+    mock_photo.assert_not_called()
+
+
+@patch("worker.task_processor.PLAN_STREAMING_ENABLED", False)
+@patch("worker.task_processor.persist_result")
+@patch("worker.task_processor.get_google_place_photo")
+@patch("worker.task_processor.get_route_for_waypoints")
+@patch("worker.task_processor.fetch_plan_from_openai")
+def test_degraded_plans_are_saved_but_not_shared_via_the_plan_cache(
+    mock_openai, mock_route, mock_photo, mock_persist
+):
+    from unittest.mock import MagicMock
+    from worker import task_processor
+    from worker.result_store import cache_plan
+
+    mock_openai.return_value = json.dumps(
+        {
+            "days": [{"morning": {"place_name": "Pergamon Museum"}}],
+            "waypoints": [{"lat": 52.52, "lng": 13.40}, {"lat": 52.39, "lng": 13.06}],
+        }
+    )
+    mock_route.side_effect = task_processor.DeadlineExceeded("route budget spent")
+    mock_photo.return_value = ""
+
+    process_task(dict(TASK))
+
+    message, plan, _route_detail, degraded = mock_persist.call_args[0]
+    assert plan["google_route"] is None
+    assert degraded == ("route",)
+
+    cur = MagicMock()
+    cache_plan(cur, message, plan, degraded)
+    partial = dict(plan, enrichment="partial")
+    cache_plan(cur, message, partial, ("photos",))
+    cur.execute.assert_not_called()
+    cache_plan(cur, message, plan)
+    cur.execute.assert_called_once()
+
+
+def test_offset_tracker_commits_only_contiguous_finished_offsets():
+    from worker.offset_tracker import OffsetTracker
+
+    tracker = OffsetTracker()
+    for offset in (10, 11, 12):
+        tracker.start("tp0", offset)
+
+    tracker.finish("tp0", 11)
+    assert tracker.committable() == {}
+
+    tracker.finish("tp0", 10)
+    assert tracker.committable() == {"tp0": 12}
+
+    tracker.finish("tp0", 12)
+    assert tracker.committable() == {"tp0": 13}
+    assert tracker.in_flight() == 0
+
+
+def test_offset_tracker_holds_failed_offsets_until_they_are_redone():
+    from worker.offset_tracker import OffsetTracker
+
+    tracker = OffsetTracker()
+    for offset in (5, 6):
+        tracker.start("tp0", offset)
+    tracker.fail("tp0", 5)
+    tracker.finish("tp0", 6)
+    assert tracker.committable() == {}
+    # the redelivered 5 runs again; 6 is done and its copy is skipped
+    assert not tracker.is_active("tp0", 5)
+    assert tracker.is_active("tp0", 6)
+
+    tracker.start("tp0", 5)
+    tracker.finish("tp0", 5)
+    assert tracker.committable() == {"tp0": 7}
+
+
+def test_tiered_cache_reads_through_to_persistent_store(tmp_path):
+    from worker.cache import MISS, TTLCache, SqliteCacheStore, TieredCache
+
+    store = SqliteCacheStore(str(tmp_path / "cache.sqlite3"))
+    writer = TieredCache("photo", TTLCache(10, 60), store, negative_ttl_seconds=5)
+    writer.set("eiffel tower|800", "https://img/eiffel.jpg")
+    writer.set("nowhere|800", None)
+
+    # a fresh process only has the persistent tier
+    reader = TieredCache("photo", TTLCache(10, 60), store, negative_ttl_seconds=5)
+    assert reader.get("eiffel tower|800") == "https://img/eiffel.jpg"
+    assert reader.get("nowhere|800") is None
+    assert reader.get("louvre|800") is MISS
+    assert reader.stats()["store_hits"] == 2
+    assert reader.stats()["misses"] == 1
+
+
+def test_write_results_saves_one_trip_for_a_users_coalesced_double_submit():
+    from unittest.mock import MagicMock, patch
+    from worker.result_store import write_results
+
+    message = dict(TASK, request_id="leader")
+    plan = {"days": [{"morning": {"place_name": "Pergamon Museum"}}]}
+    payload = json.dumps(TASK)
+    cur = MagicMock()
+    cur.fetchall.return_value = [("fp",)]
+    with patch("worker.result_store.execute_values") as execute_values:
+        execute_values.side_effect = [
+            # leader and its follower, both submitted by user 1
+            [("leader", 1, payload), ("leader", 1, payload)],
+            [(1, 10)],
+            None,
+        ]
+        write_results(cur, [(message, plan, None, ())])
+    trips = execute_values.call_args_list[1].args[2]
+    assert len(trips) == 1 and trips[0][0] == 1
+
+
+def test_write_result_batch_completes_leaders_and_followers_in_one_transaction():
+    from contextlib import contextmanager
+    from unittest.mock import MagicMock, patch
+    from worker.result_store import write_result_batch
+
+    ok = dict(TASK, request_id="ok")
+    failed = dict(TASK, request_id="failed", start_location="Rome")
+    plan = {"days": [{"morning": {"place_name": "Pergamon Museum"}}]}
+    payload = json.dumps(TASK)
+    conn = MagicMock()
+    cur = conn.cursor.return_value.__enter__.return_value
+    cur.fetchall.return_value = [("fp",)]
+    connections = []
+
+    @contextmanager
+    def connection():
+        connections.append(conn)
+        yield conn
+
+    with patch("worker.result_store.get_connection", connection), \
+            patch("worker.result_store.execute_values") as execute_values:
+        execute_values.side_effect = [
+            # the leader, a follower of another user, and the failed request
+            [("ok", 1, payload), ("ok", 2, payload), ("failed", 3, payload)],
+            [(1, 10), (2, 11)],
+            None,
+            None,
+        ]
+        write_result_batch(
+            [
+                (ok, plan, ("route-1", {"routes": []}), ()),
+                (failed, {"error": "Timed out generating the plan"}, None, ()),
+            ]
+        )
+    assert len(connections) == 1
+    complete, trips, history, routes = execute_values.call_args_list
+    # one UPDATE completes each request together with its followers
+    assert "leader_request_id" in complete.args[1]
+    assert {row[0] for row in complete.args[2]} == {"ok", "failed"}
+    # error plans get no trip or history entry
+    assert [row[0] for row in trips.args[2]] == [1, 2]
+    assert history.args[2] == [(1, 10), (2, 11)]
+    assert routes.args[2] == [("route-1", json.dumps({"routes": []}))]
+    statements = [call.args[0] for call in cur.execute.call_args_list]
+    assert sum("INSERT INTO plan_cache" in sql for sql in statements) == 1
+
+
+def test_incremental_days_parser_emits_days_as_they_complete():
+    from worker.plan_stream import IncrementalDaysParser
+
+    text = (
+        '{"days": [{"morning": {"place_name": "Gate } ]"}}, '
+        '{"noon": {"place_name": "Museum"}}], "waypoints": []}'
+    )
+    parser = IncrementalDaysParser()
+    first = parser.feed(text[:50])
+    rest = parser.feed(text[50:])
+
+    assert first == [{"morning": {"place_name": "Gate } ]"}}]
+    assert rest == [{"noon": {"place_name": "Museum"}}]
+
+
+def test_route_cache_shares_entries_within_one_quantization_cell():
+    from worker import external_apis
+
+    # the cache classes the worker's (flat) external_apis import uses
+    cache = external_apis.TieredCache("directions", external_apis.TTLCache(10, 60))
+    route = {"status": "OK", "routes": []}
+    with patch.object(external_apis, "_route_cache", cache), \
+            patch.object(external_apis, "get_google_route", return_value=route) as google:
+        # 3 decimals: both stops round to 52.520,13.405 and 52.390,13.060
+        external_apis.get_route_for_waypoints(
+            [{"lat": 52.5201, "lng": 13.4049}, {"lat": 52.3904, "lng": 13.0601}]
+        )
+        external_apis.get_route_for_waypoints(
+            [{"lat": 52.5199, "lng": 13.4051}, {"lat": 52.3896, "lng": 13.0598}]
+        )
+        assert google.call_count == 1
+        assert google.call_args.args[:2] == ("52.520,13.405", "52.390,13.060")
+
+        # a destination one cell over is a different route
+        external_apis.get_route_for_waypoints(
+            [{"lat": 52.5201, "lng": 13.4049}, {"lat": 52.3916, "lng": 13.0601}]
+        )
+        assert google.call_count == 2
+
+
+def test_compact_route_keeps_overview_and_leg_totals():
+    from worker.external_apis import compact_route
+
+    directions = {
+        "status": "OK",
+        "routes": [
+            {
+                "summary": "A100",
+                "overview_polyline": {"points": "abc"},
+                "bounds": {"northeast": {}, "southwest": {}},
+                "legs": [
+                    {
+                        "distance": {"value": 1200},
+                        "duration": {"value": 300},
+                        "start_location": {"lat": 1, "lng": 2},
+                        "end_location": {"lat": 3, "lng": 4},
+                        "steps": [{"html_instructions": "Turn left"}],
+                    }
+                ],
+            }
+        ],
     }
 
-    process_task(task)
+    compact = compact_route(directions, "key-1")
+
+    assert compact["overview_polyline"] == "abc"
+    assert compact["detail_key"] == "key-1"
+    assert compact["legs"][0]["distance"] == {"value": 1200}
+    assert "steps" not in compact["legs"][0]
+
+
+def test_batch_writer_flushes_by_size_and_isolates_failures():
+    from worker.batch_writer import BatchWriter
+
+    batches = []
+
+    def write_batch(items):
+        if "bad" in items:
+            raise ValueError("bad item")
+        batches.append(list(items))
+
+    writer = BatchWriter(write_batch, batch_size=3, max_delay_seconds=5)
+    futures = [writer.submit(item) for item in ("a", "b", "c")]
+    for future in futures:
+        future.result(timeout=2)
+    assert batches == [["a", "b", "c"]]
+
+    good, bad = writer.submit("d"), writer.submit("bad")
+    writer.close()
+    assert good.result(timeout=2) is None
+    with pytest.raises(ValueError):
+        bad.result(timeout=2)
+    assert batches[-1] == ["d"]
+
+
+def test_provider_limiter_retries_transient_errors_and_backs_off_concurrency():
+    from worker.rate_limit import (
+        AdaptiveConcurrency,
+        ProviderLimiter,
+        Retryable,
+        TokenBucket,
+    )
+
+    class Throttled(Exception):
+        pass
+
+    def classify(exc):
+        return Retryable(exc, throttled=True) if isinstance(exc, Throttled) else None
+
+    concurrency = AdaptiveConcurrency(initial=8, minimum=1, maximum=8)
+    limiter = ProviderLimiter(
+        "test", TokenBucket(0, 1), concurrency, classify, 3, 0.001, 0.01
+    )
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise Throttled()
+        return "ok"
+
+    assert limiter.call(flaky) == "ok"
+    assert len(calls) == 3
+    # halved once (the cooldown absorbs the second 429), then +1/limit on success
+    assert concurrency.limit == 4.25
+
+    with pytest.raises(ValueError):
+        limiter.call(lambda: (_ for _ in ()).throw(ValueError("not retryable")))
+
+
+def test_lane_scheduler_keeps_shares_under_contention_and_lends_idle_slots():
+    from collections import deque, namedtuple
+    from worker.lanes import Lane, LaneScheduler
+
+    TP = namedtuple("TP", "topic partition")
+    Msg = namedtuple("Msg", "offset")
+    short, long = TP("short", 0), TP("long", 0)
+    scheduler = LaneScheduler(
+        [Lane("short", "short", 3), Lane("long", "long", 1, max_slots=6)], 8
+    )
+
+    def drain():
+        started = []
+        item = scheduler.next()
+        while item is not None:
+            started.append(item[0].topic)
+            item = scheduler.next()
+        return started
+
+    # only long trips waiting: they may borrow, but not the reserved slots
+    scheduler.add({long: [Msg(i) for i in range(10)]})
+    assert drain() == ["long"] * 6
+    assert scheduler.fetching_topics() == {"short"}
+
+    # short trips arrive: they get the free slots, long keeps its backlog
+    scheduler.add({short: [Msg(i) for i in range(10)]})
+    assert drain() == ["short"] * 2
+
+    # as long tasks finish, contention caps long at its share (2 of 8)
+    scheduler.refresh([long] * 2 + [short] * 2)
+    assert drain() == ["short"] * 4
+    scheduler.refresh([long] + [short] * 6)
+    assert drain() == ["long"]
+
+    scheduler.drop([short])
+    assert scheduler.lane_for("short").queued == deque()
+
+
+def test_provider_limiter_gives_up_when_the_deadline_cannot_cover_a_retry():
+    # the worker's own (flat) import of deadline, which the limiter raises
+    from worker.rate_limit import (
+        AdaptiveConcurrency,
+        Deadline,
+        DeadlineExceeded,
+        ProviderLimiter,
+        Retryable,
+        TokenBucket,
+    )
+
+    limiter = ProviderLimiter(
+        "test",
+        TokenBucket(0, 1),
+        AdaptiveConcurrency(initial=1, minimum=1, maximum=1),
+        lambda exc: Retryable(exc, retry_after=5),
+        5,
+        0.001,
+        10,
+    )
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise ConnectionError("reset")
+
+    with pytest.raises(DeadlineExceeded):
+        limiter.call(failing, deadline=Deadline(0.5))
+    assert len(calls) == 1  # Retry-After of 5s does not fit in 0.5s
+
+    expired = Deadline(0)
+    with pytest.raises(DeadlineExceeded):
+        expired.timeout(10)
+    assert Deadline(30).stage(budget=60, reserve=10).remaining() <= 20
+
+
+def test_shared_bucket_falls_back_to_its_local_share_while_the_db_is_down():
+    from contextlib import contextmanager
+    from worker.rate_limit import SharedTokenBucket, TokenBucket
+
+    attempts = []
+
+    @contextmanager
+    def unreachable():
+        attempts.append(1)
+        raise ConnectionError("db down")
+        yield
+
+    local = TokenBucket(rate=0.01, burst=3)
+    bucket = SharedTokenBucket(
+        "test", 400, 12, 5, unreachable, fallback=local, retry_seconds=60
+    )
+    for _ in range(3):
+        bucket.acquire()
+    # one failed lease per retry window; the local share pays for the calls
+    assert len(attempts) == 1
+    assert not local.try_acquire()
+    assert not bucket._initialized
+
+
+def test_hedger_sends_a_duplicate_for_slow_calls_and_takes_the_first_answer():
+    import threading
+    import time
+    from worker.hedging import HedgePool, Hedger
+
+    hedger = Hedger(HedgePool(max_workers=2), percentile=50, min_samples=3)
+    for _ in range(3):
+        assert hedger.call(lambda: "warm") == "warm"
+    assert hedger.hedged == 0
+
+    calls = []
+    lock = threading.Lock()
+
+    def first_call_hangs():
+        with lock:
+            calls.append(1)
+            slow = len(calls) == 1
+        if slow:
+            time.sleep(1)
+            return "slow"
+        return "fast"
+
+    released = []
+    assert hedger.call(first_call_hangs, hedge_done=lambda: released.append(1)) == "fast"
+    assert (hedger.hedged, hedger.hedge_wins) == (1, 1)
+    assert released == [1]  # the duplicate gave its concurrency slot back
+
+    # no spare token: wait for the original call instead of hedging
+    calls.clear()
+    assert hedger.call(first_call_hangs, can_hedge=lambda: False) == "slow"
+    assert hedger.hedged == 1
 
-    mock_cursor.execute.assert_called_once()
-    args = mock_cursor.execute.call_args[0]
-    assert "UPDATE requests SET status" in args[0]
-    assert "test-req-id" in args[2]
+    # both threads busy: the call runs on the caller's thread, unhedged
+    gate = threading.Event()
+    hedger._pool.try_submit(gate.wait)
+    hedger._pool.try_submit(gate.wait)
+    assert hedger.call(lambda: "inline") == "inline"
+    gate.set()
@@ -0,0 +1,84 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from shared.logs import get_logger
+
+log = get_logger(__name__)
+
+_STOP = object()
+
+
+class BatchWriter:
+    """
+    Groups items submitted from many threads into batches for `write_batch`,
+    flushing once `batch_size` items are queued or the oldest queued item has
+    waited `max_delay_seconds`. Each submit() returns a Future that resolves
+    only after the batch holding the item was written, so callers can block on
+    it before acknowledging their work.
+
+    If a batch fails, its items are retried one by one so a single bad item
+    only fails its own future.
+    """
+
+    def __init__(self, write_batch, batch_size: int, max_delay_seconds: float):
+        self._write_batch = write_batch
+        self.batch_size = max(1, batch_size)
+        self.max_delay_seconds = max_delay_seconds
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="batch-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def close(self):
+        """Flush everything already submitted, then stop the writer thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    pending = (
+                        self._queue.get(timeout=remaining)
+                        if remaining > 0
+                        else self._queue.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+                if pending is _STOP:
+                    stopping = True
+                    break
+                batch.append(pending)
+            self._flush(batch)
+
+    def _flush(self, batch: list):
+        try:
+            self._write_batch([item for item, _future in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            log.warning(
+                "Batch write failed, retrying items singly",
+                extra={"batch_size": len(batch), "error": str(e)},
+            )
+            for entry in batch:
+                self._flush([entry])
+            return
+        for _item, future in batch:
+            future.set_result(None)
@@ -0,0 +1,219 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from shared.logs import get_logger
+
+log = get_logger(__name__)
+
+# Returned by get() when nothing usable is cached. `None` is a valid cached
+# value (negative caching), so it cannot double as the "miss" marker.
+MISS = object()
+
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU with a per-entry expiry time.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] <= time.time():
+                if item is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl_seconds: float = None, expires_at: float = None):
+        if expires_at is None:
+            expires_at = time.time() + (
+                self.ttl_seconds if ttl_seconds is None else ttl_seconds
+            )
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCacheStore:
+    """
+    Persistent cache tier in a local SQLite file, shared by every worker
+    process on the host and surviving restarts. Values are stored as JSON.
+    The file (and its directory) is created on first use, not on import.
+    """
+
+    PRUNE_EVERY = 500  # writes between sweeps of expired rows
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _create(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                # surface it like any other store failure, which callers tolerate
+                raise sqlite3.OperationalError(f"cannot create {directory}: {e}") from e
+        with sqlite3.connect(self.path, timeout=5) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+        conn.close()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            with self._init_lock:
+                if not self._initialized:
+                    self._create()
+                    self._initialized = True
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str):
+        """Return (value, expires_at), or MISS if absent or expired."""
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value, expires_at FROM cache_entries "
+                "WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time()),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return MISS
+        return json.loads(row[0]), row[1]
+
+    def set(
+        self, namespace: str, key: str, value, expires_at: float, max_rows: int = None
+    ):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                conn.execute(
+                    "DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),)
+                )
+                if max_rows is not None:
+                    # keep the entries that live longest, i.e. the newest ones
+                    conn.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                        " SELECT key FROM cache_entries WHERE namespace = ?"
+                        " ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                        (namespace, namespace, max_rows),
+                    )
+
+
+class TieredCache:
+    """
+    In-process TTLCache in front of an optional persistent store.
+    `None` results are cached too, for `negative_ttl_seconds`, and the
+    store keeps roughly `store_max_entries` rows for this namespace.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        memory: TTLCache,
+        store: SqliteCacheStore = None,
+        negative_ttl_seconds: float = None,
+        store_max_entries: int = None,
+    ):
+        self.namespace = namespace
+        self.memory = memory
+        self.store = store
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.store_max_entries = store_max_entries
+        self.store_hits = 0
+        self.store_errors = 0
+
+    def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not MISS or self.store is None:
+            return value
+        try:
+            found = self.store.get(self.namespace, key)
+        except sqlite3.Error as e:
+            self.store_errors += 1
+            log.warning(
+                "Cache store read failed", extra={"cache": self.namespace, "error": str(e)}
+            )
+            return MISS
+        if found is MISS:
+            return MISS
+        value, expires_at = found
+        self.store_hits += 1
+        self.memory.set(key, value, expires_at=expires_at)
+        return value
+
+    def set(self, key: str, value):
+        ttl = self.memory.ttl_seconds
+        if value is None and self.negative_ttl_seconds is not None:
+            ttl = self.negative_ttl_seconds
+        expires_at = time.time() + ttl
+        self.memory.set(key, value, expires_at=expires_at)
+        if self.store is None:
+            return
+        try:
+            self.store.set(
+                self.namespace, key, value, expires_at, self.store_max_entries
+            )
+        except sqlite3.Error as e:
+            self.store_errors += 1
+            log.warning(
+                "Cache store write failed", extra={"cache": self.namespace, "error": str(e)}
+            )
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.memory.hits,
+            "store_hits": self.store_hits,
+            # memory misses that the store then answered are not real misses
+            "misses": self.memory.misses - self.store_hits,
+            "evictions": self.memory.evictions,
+            "store_errors": self.store_errors,
+            "size": len(self.memory),
+        }
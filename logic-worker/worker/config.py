@@ -6,5 +6,160 @@ GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 STATE_DB_URL = os.getenv("STATE_DB_URL")
 APP_DB_URL = os.getenv("APP_DB_URL")
 
+# Endpoints can be pointed at local stand-ins (see benchmarks/); unset uses
+# the OpenAI client's default
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+GOOGLE_MAPS_BASE_URL = os.getenv(
+    "GOOGLE_MAPS_BASE_URL", "https://maps.googleapis.com"
+).rstrip("/")
+
 KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "trip_requests")
 KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
+KAFKA_GROUP_ID = os.getenv("KAFKA_GROUP_ID", "trip_worker_group")
+# Long trips arrive on shared.config.KAFKA_TOPIC_LONG (empty: one lane). While
+# both lanes have work waiting, each gets its weighted share of
+# WORKER_CONCURRENCY; the long lane never borrows the last
+# LANE_SHORT_RESERVED_SLOTS slots. Lanes run independently, so a user's
+# requests are only processed in order within a lane, not across lanes.
+LANE_WEIGHT_SHORT = float(os.getenv("LANE_WEIGHT_SHORT", 3))
+LANE_WEIGHT_LONG = float(os.getenv("LANE_WEIGHT_LONG", 1))
+
+# Consumer processes started by main.py, each one a member of KAFKA_GROUP_ID.
+# Local (non-shared) provider rate limits are split evenly between them.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", 1))
+
+# Number of trips planned in parallel by one worker process
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 8))
+KAFKA_POLL_TIMEOUT_MS = int(os.getenv("KAFKA_POLL_TIMEOUT_MS", 500))
+LANE_SHORT_RESERVED_SLOTS = int(
+    os.getenv("LANE_SHORT_RESERVED_SLOTS", max(1, WORKER_CONCURRENCY // 4))
+)
+
+# Photo lookups run in parallel on a pool shared by all tasks in the process
+PHOTO_ENRICH_CONCURRENCY = int(os.getenv("PHOTO_ENRICH_CONCURRENCY", 16))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 32))
+
+# Local on-disk cache shared by all worker processes on the host. Opt-in:
+# docker-compose points it at the worker-cache volume; unset means memory only.
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "")
+
+PHOTO_CACHE_MAX_ENTRIES = int(os.getenv("PHOTO_CACHE_MAX_ENTRIES", 10000))
+PHOTO_CACHE_TTL_SECONDS = int(os.getenv("PHOTO_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+PHOTO_CACHE_NEGATIVE_TTL_SECONDS = int(
+    os.getenv("PHOTO_CACHE_NEGATIVE_TTL_SECONDS", 24 * 3600)
+)
+
+# Directions cache: stops are rounded to ROUTE_CACHE_PRECISION decimals
+# (3 ≈ 100 m) so near-identical LLM coordinates share an entry.
+ROUTE_CACHE_PRECISION = int(os.getenv("ROUTE_CACHE_PRECISION", 3))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", 2000))
+ROUTE_CACHE_STORE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_STORE_MAX_ENTRIES", 50000))
+ROUTE_CACHE_TTL_SECONDS = int(os.getenv("ROUTE_CACHE_TTL_SECONDS", 24 * 3600))
+
+# Cross-user plan cache in the state DB, read by the api-server on /submit
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", 100000))
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+
+# Finished (done/error) requests are deleted this long after submission; their
+# trips stay in history. /status returns 404 for them afterwards.
+REQUEST_RETENTION_SECONDS = int(os.getenv("REQUEST_RETENTION_SECONDS", 7 * 24 * 3600))
+# Full Directions responses neither stored nor fetched for this long are
+# deleted; GET /routes/{key} then 404s while the plan keeps its compact route
+ROUTE_DETAILS_TTL_SECONDS = int(os.getenv("ROUTE_DETAILS_TTL_SECONDS", 30 * 24 * 3600))
+
+# Stream the OpenAI completion and publish finished days while it generates
+PLAN_STREAMING_ENABLED = os.getenv("PLAN_STREAMING_ENABLED", "true").lower() == "true"
+PARTIAL_RESULT_MIN_INTERVAL_SECONDS = float(
+    os.getenv("PARTIAL_RESULT_MIN_INTERVAL_SECONDS", 1.0)
+)
+
+# Keep full Directions responses (every step) in route_details, fetchable via
+# the api-server's /routes/{key}; plans themselves only carry a compact route.
+ROUTE_STORE_DETAIL = os.getenv("ROUTE_STORE_DETAIL", "true").lower() == "true"
+
+# Pooled state-DB connections shared by tasks, partial-result saves and the
+# batched result writer
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", WORKER_CONCURRENCY + 2))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", 30))
+
+# In concurrent mode finished results are written in batches, flushed when
+# RESULT_BATCH_SIZE results are queued or the oldest has waited this long
+RESULT_BATCH_SIZE = int(os.getenv("RESULT_BATCH_SIZE", 16))
+RESULT_BATCH_MAX_DELAY_MS = int(os.getenv("RESULT_BATCH_MAX_DELAY_MS", 50))
+
+# Prometheus /metrics port (0 disables; process i serves METRICS_PORT + i) and
+# how often consumer lag is refreshed
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+CONSUMER_LAG_INTERVAL_SECONDS = float(os.getenv("CONSUMER_LAG_INTERVAL_SECONDS", 5))
+
+# Per-provider rate limits: sustained calls per second (<= 0 disables), burst,
+# and bounds for the adaptive (AIMD) limit on calls in flight
+OPENAI_RATE_PER_SECOND = float(os.getenv("OPENAI_RATE_PER_SECOND", 5))
+OPENAI_BURST = float(os.getenv("OPENAI_BURST", 10))
+OPENAI_MIN_CONCURRENCY = int(os.getenv("OPENAI_MIN_CONCURRENCY", 1))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", WORKER_CONCURRENCY))
+GOOGLE_DIRECTIONS_RATE_PER_SECOND = float(
+    os.getenv("GOOGLE_DIRECTIONS_RATE_PER_SECOND", 20)
+)
+GOOGLE_DIRECTIONS_BURST = float(os.getenv("GOOGLE_DIRECTIONS_BURST", 20))
+GOOGLE_DIRECTIONS_MAX_CONCURRENCY = int(
+    os.getenv("GOOGLE_DIRECTIONS_MAX_CONCURRENCY", WORKER_CONCURRENCY)
+)
+GOOGLE_PLACES_RATE_PER_SECOND = float(os.getenv("GOOGLE_PLACES_RATE_PER_SECOND", 50))
+GOOGLE_PLACES_BURST = float(os.getenv("GOOGLE_PLACES_BURST", 50))
+GOOGLE_PLACES_MAX_CONCURRENCY = int(
+    os.getenv("GOOGLE_PLACES_MAX_CONCURRENCY", PHOTO_ENRICH_CONCURRENCY)
+)
+
+# Share the token buckets across replicas through the state DB's rate_limits
+# table, leasing this many tokens per round trip. When the DB is unreachable,
+# use the per-process local bucket for this long before trying it again.
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "false").lower() == "true"
+RATE_LIMIT_LEASE = int(os.getenv("RATE_LIMIT_LEASE", 5))
+RATE_LIMIT_SHARED_RETRY_SECONDS = float(os.getenv("RATE_LIMIT_SHARED_RETRY_SECONDS", 30))
+
+# Retries of 429/5xx/connection failures, with full-jitter exponential backoff
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 4))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", 0.5))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", 20))
+
+# Every task must finish within TASK_DEADLINE_SECONDS. Its external calls get
+# what is left, minus PERSIST_RESERVE_SECONDS kept back for saving the result;
+# route and photos also have their own budgets. A stage that runs out of time
+# is skipped (no route, fewer photos) rather than holding the task.
+TASK_DEADLINE_SECONDS = float(os.getenv("TASK_DEADLINE_SECONDS", 150))
+PERSIST_RESERVE_SECONDS = float(os.getenv("PERSIST_RESERVE_SECONDS", 5))
+ROUTE_BUDGET_SECONDS = float(os.getenv("ROUTE_BUDGET_SECONDS", 15))
+PHOTO_BUDGET_SECONDS = float(os.getenv("PHOTO_BUDGET_SECONDS", 30))
+
+# How long a revoked partition's in-flight tasks may run before it is handed
+# over. kafka-python revokes every partition on each rebalance, so this is
+# never below a task's deadline plus the persist reserve: a task cut off here
+# would be started again when its partition comes back. The consumer's
+# max.poll.interval.ms, which bounds a rebalance, is raised to fit it.
+KAFKA_REBALANCE_DRAIN_SECONDS = max(
+    float(os.getenv("KAFKA_REBALANCE_DRAIN_SECONDS", 0)),
+    TASK_DEADLINE_SECONDS + PERSIST_RESERVE_SECONDS,
+)
+
+# Per-call timeouts, further capped by the task's deadline. When streaming,
+# the OpenAI timeout applies to each wait for the next chunk.
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", 90))
+GOOGLE_CONNECT_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_CONNECT_TIMEOUT_SECONDS", 3.05))
+GOOGLE_READ_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_READ_TIMEOUT_SECONDS", 10))
+
+# Hedged Google lookups: a call still running after the GOOGLE_HEDGE_PERCENTILE
+# latency of recent calls gets a duplicate, if the rate limit has a token to
+# spare, and the first answer wins
+GOOGLE_HEDGE_ENABLED = os.getenv("GOOGLE_HEDGE_ENABLED", "false").lower() == "true"
+GOOGLE_HEDGE_PERCENTILE = float(os.getenv("GOOGLE_HEDGE_PERCENTILE", 95))
+GOOGLE_HEDGE_MIN_SAMPLES = int(os.getenv("GOOGLE_HEDGE_MIN_SAMPLES", 50))
+# Threads for hedged calls: every Google call in flight plus one duplicate each
+GOOGLE_HEDGE_THREADS = int(
+    os.getenv(
+        "GOOGLE_HEDGE_THREADS",
+        2 * (GOOGLE_DIRECTIONS_MAX_CONCURRENCY + GOOGLE_PLACES_MAX_CONCURRENCY),
+    )
+)
@@ -0,0 +1,71 @@
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+from config import (
+    STATE_DB_URL,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_TIMEOUT_SECONDS,
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises when empty; make callers wait for a slot instead
+_slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE)
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pg_pool.ThreadedConnectionPool(
+                    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, STATE_DB_URL
+                )
+    return _pool
+
+
+@contextmanager
+def get_connection():
+    """
+    Borrow a pooled connection for the block; commits on success, rolls back
+    on error. Connections found closed are discarded instead of returned.
+    """
+    if not _slots.acquire(timeout=DB_POOL_TIMEOUT_SECONDS):
+        raise RuntimeError(
+            f"No database connection available after {DB_POOL_TIMEOUT_SECONDS}s"
+        )
+    try:
+        pool = get_pool()
+        conn = pool.getconn()
+        while conn.closed:
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    except Exception:
+        _slots.release()
+        raise
+
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+        _slots.release()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
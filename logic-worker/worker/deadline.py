@@ -0,0 +1,49 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    """An external call could not finish before its task's deadline."""
+
+
+class Deadline:
+    """
+    A point in time a task's external calls must finish by. Pass one down to
+    every call; each derives its own timeout from what is left, so a hung
+    socket or a long retry can never outlive the task.
+    """
+
+    def __init__(self, seconds: float = None):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float | None:
+        """Seconds left (never negative), or None without a deadline."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def timeout(self, cap: float) -> float:
+        """`cap`, shortened to what is left; raises once nothing is left."""
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        if remaining <= 0:
+            raise DeadlineExceeded("deadline passed")
+        return min(cap, remaining)
+
+    def stage(self, budget: float = None, reserve: float = 0.0) -> "Deadline":
+        """
+        A deadline for one stage: at most `budget` seconds from now, ending
+        `reserve` seconds before this one so later work keeps its time.
+        """
+        child = Deadline(budget)
+        if self.expires_at is not None:
+            end = self.expires_at - reserve
+            child.expires_at = end if child.expires_at is None else min(child.expires_at, end)
+        return child
+
+
+NO_DEADLINE = Deadline()
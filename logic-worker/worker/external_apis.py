@@ -1,17 +1,292 @@
 import os
-import json
+import hashlib
 import re
 import urllib.parse
+import openai
 from openai import OpenAI
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
 
-# initialize a single OpenAI client
-_openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from cache import MISS, TTLCache, SqliteCacheStore, TieredCache
+from db import get_connection
+from deadline import NO_DEADLINE, Deadline, DeadlineExceeded
+from hedging import HedgePool, Hedger
+from rate_limit import (
+    AdaptiveConcurrency,
+    ProviderLimiter,
+    Retryable,
+    SharedTokenBucket,
+    TokenBucket,
+)
+from shared.logs import RateSampler, get_logger
+from config import (
+    OPENAI_BASE_URL,
+    GOOGLE_MAPS_BASE_URL,
+    HTTP_POOL_MAXSIZE,
+    CACHE_DB_PATH,
+    PHOTO_CACHE_MAX_ENTRIES,
+    PHOTO_CACHE_TTL_SECONDS,
+    PHOTO_CACHE_NEGATIVE_TTL_SECONDS,
+    ROUTE_CACHE_PRECISION,
+    ROUTE_CACHE_MAX_ENTRIES,
+    ROUTE_CACHE_STORE_MAX_ENTRIES,
+    ROUTE_CACHE_TTL_SECONDS,
+    OPENAI_RATE_PER_SECOND,
+    OPENAI_BURST,
+    OPENAI_MIN_CONCURRENCY,
+    OPENAI_MAX_CONCURRENCY,
+    GOOGLE_DIRECTIONS_RATE_PER_SECOND,
+    GOOGLE_DIRECTIONS_BURST,
+    GOOGLE_DIRECTIONS_MAX_CONCURRENCY,
+    GOOGLE_PLACES_RATE_PER_SECOND,
+    GOOGLE_PLACES_BURST,
+    GOOGLE_PLACES_MAX_CONCURRENCY,
+    RATE_LIMIT_SHARED,
+    RATE_LIMIT_LEASE,
+    RATE_LIMIT_SHARED_RETRY_SECONDS,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_BASE_DELAY_SECONDS,
+    RETRY_MAX_DELAY_SECONDS,
+    WORKER_PROCESSES,
+    OPENAI_TIMEOUT_SECONDS,
+    GOOGLE_CONNECT_TIMEOUT_SECONDS,
+    GOOGLE_READ_TIMEOUT_SECONDS,
+    GOOGLE_HEDGE_ENABLED,
+    GOOGLE_HEDGE_PERCENTILE,
+    GOOGLE_HEDGE_MIN_SAMPLES,
+    GOOGLE_HEDGE_THREADS,
+)
+
+log = get_logger(__name__)
+# these fire once per photo slot; keep a sample
+_places_log_sampler = RateSampler(20)
+
+# initialize a single OpenAI client; retries are done by _openai_limiter
+_openai_client = OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL, max_retries=0
+)
 GOOGLE_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 
+# one keep-alive session for all Google calls, shared across threads
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_maxsize=HTTP_POOL_MAXSIZE))
+_http.mount("http://", HTTPAdapter(pool_maxsize=HTTP_POOL_MAXSIZE))
+
+_cache_store = SqliteCacheStore(CACHE_DB_PATH) if CACHE_DB_PATH else None
+_photo_cache = TieredCache(
+    "place_photo",
+    TTLCache(PHOTO_CACHE_MAX_ENTRIES, PHOTO_CACHE_TTL_SECONDS),
+    _cache_store,
+    negative_ttl_seconds=PHOTO_CACHE_NEGATIVE_TTL_SECONDS,
+)
+_route_cache = TieredCache(
+    "directions",
+    TTLCache(ROUTE_CACHE_MAX_ENTRIES, ROUTE_CACHE_TTL_SECONDS),
+    _cache_store,
+    store_max_entries=ROUTE_CACHE_STORE_MAX_ENTRIES,
+)
+
+# Places statuses that are a real answer about the place (safe to cache),
+# as opposed to quota/auth/transient failures.
+_CACHEABLE_PLACES_STATUSES = ("OK", "ZERO_RESULTS")
+
+
+class GoogleStatusError(Exception):
+    """A 200 response whose body reports a transient failure (quota, backend error)."""
+
+    def __init__(self, status: str):
+        super().__init__(f"Google API status {status}")
+        self.status = status
+
+
+_RETRYABLE_GOOGLE_STATUSES = ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR")
+
+
+def _retry_after(headers) -> float | None:
+    """Seconds from retry-after-ms / Retry-After (delta-seconds form only)."""
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def _classify_google_error(exc: Exception):
+    if isinstance(exc, GoogleStatusError):
+        return Retryable(exc, throttled=exc.status == "OVER_QUERY_LIMIT")
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        if status == 429 or status >= 500:
+            return Retryable(
+                exc, throttled=status == 429, retry_after=_retry_after(exc.response.headers)
+            )
+        return None
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return Retryable(exc)
+    return None
+
+
+def _classify_openai_error(exc: Exception):
+    if isinstance(exc, openai.RateLimitError):
+        if getattr(exc, "code", None) == "insufficient_quota":
+            return None  # billing, not rate: retrying cannot help
+        return Retryable(exc, throttled=True, retry_after=_retry_after(exc.response.headers))
+    if isinstance(exc, openai.APIStatusError) and exc.status_code >= 500:
+        return Retryable(exc, retry_after=_retry_after(exc.response.headers))
+    if isinstance(exc, openai.APIConnectionError):  # includes timeouts
+        return Retryable(exc)
+    return None
+
+
+def _limiter(name, rate, burst, min_concurrency, max_concurrency, classify):
+    # each worker process gets its share of the provider's quota
+    processes = max(1, WORKER_PROCESSES)
+    bucket = TokenBucket(rate / processes, burst / processes)
+    if RATE_LIMIT_SHARED:
+        # while the DB is down, other replicas fall back too: stay within
+        # this process's share rather than spending the whole quota
+        bucket = SharedTokenBucket(
+            name,
+            rate,
+            burst,
+            RATE_LIMIT_LEASE,
+            get_connection,
+            fallback=bucket,
+            retry_seconds=RATE_LIMIT_SHARED_RETRY_SECONDS,
+        )
+    return ProviderLimiter(
+        name,
+        bucket,
+        AdaptiveConcurrency(max_concurrency, min_concurrency, max_concurrency),
+        classify,
+        RETRY_MAX_ATTEMPTS,
+        RETRY_BASE_DELAY_SECONDS,
+        RETRY_MAX_DELAY_SECONDS,
+    )
+
+
+# One limiter per provider quota, shared by every task in the process
+_openai_limiter = _limiter(
+    "openai",
+    OPENAI_RATE_PER_SECOND,
+    OPENAI_BURST,
+    OPENAI_MIN_CONCURRENCY,
+    OPENAI_MAX_CONCURRENCY,
+    _classify_openai_error,
+)
+_directions_limiter = _limiter(
+    "google_directions",
+    GOOGLE_DIRECTIONS_RATE_PER_SECOND,
+    GOOGLE_DIRECTIONS_BURST,
+    1,
+    GOOGLE_DIRECTIONS_MAX_CONCURRENCY,
+    _classify_google_error,
+)
+_places_limiter = _limiter(
+    "google_places",
+    GOOGLE_PLACES_RATE_PER_SECOND,
+    GOOGLE_PLACES_BURST,
+    1,
+    GOOGLE_PLACES_MAX_CONCURRENCY,
+    _classify_google_error,
+)
+
+
+# Hedged calls and their copies run here, so the calling thread only waits;
+# one Hedger per endpoint because their latencies differ by an order of magnitude
+_hedge_pool = HedgePool(GOOGLE_HEDGE_THREADS) if GOOGLE_HEDGE_ENABLED else None
+_hedgers = {
+    endpoint: Hedger(_hedge_pool, GOOGLE_HEDGE_PERCENTILE, GOOGLE_HEDGE_MIN_SAMPLES)
+    for endpoint in ("directions", "textsearch", "photo")
+}
+
+
+def get_limiter_stats() -> dict:
+    return {
+        limiter.name: {
+            "concurrency_limit": limiter.concurrency.limit,
+            "in_flight": limiter.concurrency.in_flight,
+        }
+        for limiter in (_openai_limiter, _directions_limiter, _places_limiter)
+    }
+
+
+def get_hedge_stats() -> dict:
+    return {
+        endpoint: {"hedged": hedger.hedged, "hedge_wins": hedger.hedge_wins}
+        for endpoint, hedger in _hedgers.items()
+    }
+
+
+def _google_get(
+    limiter: ProviderLimiter, endpoint: str, url: str, params: dict, deadline: Deadline, **kwargs
+):
+    """
+    One GET to Google with timeouts capped by `deadline`, hedged when
+    enabled. A hedge only goes out if `limiter` has a token and a
+    concurrency slot to spare; it holds the slot until it finishes.
+    """
+    timeout = (
+        deadline.timeout(GOOGLE_CONNECT_TIMEOUT_SECONDS),
+        deadline.timeout(GOOGLE_READ_TIMEOUT_SECONDS),
+    )
+
+    def get():
+        return _http.get(url, params=params, timeout=timeout, **kwargs)
+
+    if not GOOGLE_HEDGE_ENABLED:
+        return get()
+
+    def can_hedge():
+        if not limiter.concurrency.try_acquire():
+            return False
+        if not limiter.bucket.try_acquire():
+            limiter.concurrency.release()
+            return False
+        return True
+
+    return _hedgers[endpoint].call(
+        get, can_hedge=can_hedge, hedge_done=limiter.concurrency.release
+    )
+
+
+def _google_json(
+    limiter: ProviderLimiter,
+    endpoint: str,
+    url: str,
+    params: dict,
+    deadline: Deadline = NO_DEADLINE,
+) -> dict:
+    """GET a Google JSON endpoint under `limiter`, retrying transient failures."""
+
+    def call():
+        resp = _google_get(limiter, endpoint, url, params, deadline)
+        resp.raise_for_status()
+        data = resp.json()
+        if data.get("status") in _RETRYABLE_GOOGLE_STATUSES:
+            raise GoogleStatusError(data["status"])
+        return data
+
+    return limiter.call(call, deadline=deadline)
+
+
+def _normalize_place_name(name: str) -> str:
+    return " ".join(name.lower().split())
 
-def fetch_plan_from_openai(prompt: str) -> str:
+
+def get_cache_stats() -> dict:
+    return {
+        "place_photo": _photo_cache.stats(),
+        "directions": _route_cache.stats(),
+    }
+
+
+def _plan_messages(prompt: str) -> list:
     system = (
         "You are an expert trip‐planner.  "
         "Given the user’s request, *return exactly one JSON object* "
@@ -20,24 +295,68 @@ def fetch_plan_from_openai(prompt: str) -> str:
         "  • waypoints: an array of {lat, lng} for the trip path\n\n"
         "Do not include any markdown, commentary, or extra keys—only the JSON."
     )
-    resp = _openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.7,
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def fetch_plan_from_openai(prompt: str, deadline: Deadline = NO_DEADLINE) -> str:
+    resp = _openai_limiter.call(
+        lambda: _openai_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=_plan_messages(prompt),
+            temperature=0.7,
+            timeout=deadline.timeout(OPENAI_TIMEOUT_SECONDS),
+        ),
+        deadline=deadline,
     )
     return resp.choices[0].message.content
 
 
-def get_google_route(origin: str, destination: str, waypoints: str = None) -> dict:
+def stream_plan_from_openai(prompt: str, deadline: Deadline = NO_DEADLINE):
+    """
+    Same request as `fetch_plan_from_openai`, but yields the completion text
+    chunk by chunk as it is generated. Raises DeadlineExceeded (and closes
+    the stream) if generation runs past `deadline`.
+    """
+    # the concurrency slot is held until the stream is consumed; only opening
+    # the stream is retried, never a stream that already yielded text
+    with _openai_limiter.concurrency.slot(deadline):
+        stream = _openai_limiter.call(
+            lambda: _openai_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=_plan_messages(prompt),
+                temperature=0.7,
+                stream=True,
+                # bounds each wait for the next chunk
+                timeout=deadline.timeout(OPENAI_TIMEOUT_SECONDS),
+            ),
+            hold_slot=False,
+            deadline=deadline,
+        )
+        try:
+            for chunk in stream:
+                if deadline.expired():
+                    raise DeadlineExceeded("OpenAI stream ran past the deadline")
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            stream.close()
+
+
+def get_google_route(
+    origin: str,
+    destination: str,
+    waypoints: str = None,
+    deadline: Deadline = NO_DEADLINE,
+) -> dict:
     """
     Fetch a driving route from `origin` to `destination`, optionally through
     a pipe-separated list of `waypoints` (e.g. "lat1,lng1|lat2,lng2").
     """
     key = os.getenv("GOOGLE_MAPS_API_KEY")
-    url = "https://maps.googleapis.com/maps/api/directions/json"
+    url = f"{GOOGLE_MAPS_BASE_URL}/maps/api/directions/json"
     params = {
         "origin": origin,
         "destination": destination,
@@ -45,68 +364,174 @@ def get_google_route(origin: str, destination: str, waypoints: str = None) -> di
     }
     if waypoints:
         params["waypoints"] = waypoints
-    resp = requests.get(url, params=params)
-    resp.raise_for_status()
-    return resp.json()
+    return _google_json(_directions_limiter, "directions", url, params, deadline)
+
+
+def _quantize(point: dict) -> str:
+    p = ROUTE_CACHE_PRECISION
+    return f"{float(point['lat']):.{p}f},{float(point['lng']):.{p}f}"
+
+
+def get_route_for_waypoints(wpts: list, deadline: Deadline = NO_DEADLINE) -> dict:
+    """
+    Directions through a list of {lat, lng} stops (at least two), cached by
+    the stops quantized to ROUTE_CACHE_PRECISION decimals. The quantized
+    coordinates are also what gets sent to Google, so a cached entry is
+    exactly the route its key describes.
+    """
+    stops = [_quantize(w) for w in wpts]
+    key = "|".join(stops)
+    cached = _route_cache.get(key)
+    if cached is not MISS:
+        return cached
+
+    route = get_google_route(
+        stops[0],
+        stops[-1],
+        waypoints="|".join(stops[1:-1]) or None,
+        deadline=deadline,
+    )
+    if route.get("status") in ("OK", "ZERO_RESULTS"):
+        _route_cache.set(key, route)
+    return route
 
 
-def find_place_photo_reference(place_name: str) -> str | None:
+def route_key(wpts: list) -> str:
+    """Stable id for the quantized stops, used to store and fetch full route detail."""
+    stops = "|".join(_quantize(w) for w in wpts)
+    return hashlib.sha1(stops.encode("utf-8")).hexdigest()
+
+
+def compact_route(directions: dict, detail_key: str = None) -> dict:
+    """
+    Reduce a Directions response to what the UI draws: the overview polyline,
+    bounds, and per-leg distance/duration/endpoints. Step-level detail is
+    dropped; `detail_key` says where the full response can be fetched.
+    """
+    compact = {"status": directions.get("status"), "detail_key": detail_key}
+    routes = directions.get("routes") or []
+    if not routes:
+        compact["legs"] = []
+        return compact
+    route = routes[0]
+    compact.update(
+        {
+            "summary": route.get("summary"),
+            "overview_polyline": (route.get("overview_polyline") or {}).get("points"),
+            "bounds": route.get("bounds"),
+            "legs": [
+                {
+                    "distance": leg.get("distance"),
+                    "duration": leg.get("duration"),
+                    "start_location": leg.get("start_location"),
+                    "end_location": leg.get("end_location"),
+                }
+                for leg in route.get("legs", [])
+            ],
+        }
+    )
+    return compact
+
+
+def find_place_photo_reference(
+    place_name: str, deadline: Deadline = NO_DEADLINE
+) -> str | None:
     """
     Uses Google Places Text Search to look up a place by name and return its first photo_reference.
     """
+    key = f"ref|{_normalize_place_name(place_name)}"
+    cached = _photo_cache.get(key)
+    if cached is not MISS:
+        return cached
+
     GOOGLE_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
-    url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+    url = f"{GOOGLE_MAPS_BASE_URL}/maps/api/place/textsearch/json"
     params = {"query": place_name, "key": GOOGLE_KEY}
-    resp = requests.get(url, params=params)
-    resp.raise_for_status()
-    data = resp.json()
+    data = _google_json(_places_limiter, "textsearch", url, params, deadline)
+    photo_ref = None
     if data.get("results") and data["results"][0].get("photos"):
-        return data["results"][0]["photos"][0]["photo_reference"]
-    return None
+        photo_ref = data["results"][0]["photos"][0]["photo_reference"]
+    if data.get("status") in _CACHEABLE_PLACES_STATUSES:
+        _photo_cache.set(key, photo_ref)
+    return photo_ref
+
+
+def get_google_place_photo(
+    query: str, max_width: int = 800, deadline: Deadline = NO_DEADLINE
+) -> str | None:
+    """
+    Cached front for `_fetch_google_place_photo`, keyed by the normalized
+    place name and `max_width`. "No photo" answers are cached for a shorter
+    time; failures that say nothing about the place are not cached.
+    """
+    key = f"url|{_normalize_place_name(query)}|{max_width}"
+    cached = _photo_cache.get(key)
+    if cached is not MISS:
+        return cached
+
+    url, cacheable = _fetch_google_place_photo(query, max_width, deadline)
+    if cacheable:
+        _photo_cache.set(key, url)
+    return url
 
 
-def get_google_place_photo(query: str, max_width: int = 800) -> str | None:
+def _fetch_google_place_photo(
+    query: str, max_width: int, deadline: Deadline = NO_DEADLINE
+) -> tuple[str | None, bool]:
     """
     1) Text‐search the place by name.
     2) Grab the first photo_reference.
     3) Call the Place Photo endpoint (no redirect).
-    4) Return the Location header (actual image URL).
+    4) Return the Location header (actual image URL), plus whether the
+       outcome is safe to cache.
     """
     # 1) Find the place via Text Search
-    ts_url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+    ts_url = f"{GOOGLE_MAPS_BASE_URL}/maps/api/place/textsearch/json"
     ts_params = {"query": query, "key": GOOGLE_API_KEY}
-    ts_res = requests.get(ts_url, params=ts_params)
-    ts_res.raise_for_status()
-    ts_data = ts_res.json()
+    ts_data = _google_json(_places_limiter, "textsearch", ts_url, ts_params, deadline)
     if ts_data.get("status") != "OK" or not ts_data.get("results"):
-        print(f"Places TextSearch failed: {ts_data.get('status')}")
-        return None
+        if _places_log_sampler():
+            log.info("Places TextSearch failed", extra={"status": ts_data.get("status")})
+        return None, ts_data.get("status") in _CACHEABLE_PLACES_STATUSES
 
     photos = ts_data["results"][0].get("photos")
     if not photos:
-        print("No photos found in TextSearch result")
-        return None
+        if _places_log_sampler():
+            log.debug("No photos found in TextSearch result", extra={"query": query})
+        return None, True
 
     photo_ref = photos[0]["photo_reference"]
 
     # 2) Fetch the actual image URL via the Place Photo endpoint
-    photo_url = "https://maps.googleapis.com/maps/api/place/photo"
+    photo_url = f"{GOOGLE_MAPS_BASE_URL}/maps/api/place/photo"
     photo_params = {
         "photoreference": photo_ref,
         "maxwidth": max_width,
         "key": GOOGLE_API_KEY,
     }
     # IMPORTANT: don't auto‐follow the redirect; we want the Location header
-    photo_res = requests.get(photo_url, params=photo_params, allow_redirects=False)
+    def fetch_photo():
+        res = _google_get(
+            _places_limiter,
+            "photo",
+            photo_url,
+            photo_params,
+            deadline,
+            allow_redirects=False,
+        )
+        if res.status_code == 429 or res.status_code >= 500:
+            res.raise_for_status()
+        return res
+
+    photo_res = _places_limiter.call(fetch_photo, deadline=deadline)
     if photo_res.status_code in (301, 302):
-        return photo_res.headers.get("Location")
+        return photo_res.headers.get("Location"), True
     else:
-        print(
-            "Unexpected status from Photo endpoint:",
-            photo_res.status_code,
-            photo_res.text,
+        log.warning(
+            "Unexpected status from Photo endpoint",
+            extra={"status": photo_res.status_code, "body": photo_res.text},
         )
-        return None
+        return None, False
 
 
 def extract_landmark_name(image_url: str) -> str:
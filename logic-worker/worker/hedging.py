@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class HedgePool:
+    """
+    Threads for hedged calls. A call is only handed over when a thread is
+    free right now, so nothing waits in the executor's queue: hedging is
+    skipped instead, and queue time never shows up as provider latency.
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "hedge"):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=thread_name_prefix
+        )
+        self._free = threading.BoundedSemaphore(max_workers)
+
+    def try_submit(self, fn):
+        """Start `fn` on a free thread and return its future, or None."""
+        if not self._free.acquire(blocking=False):
+            return None
+
+        def run():
+            try:
+                return fn()
+            finally:
+                self._free.release()
+
+        try:
+            return self._executor.submit(run)
+        except Exception:
+            self._free.release()
+            raise
+
+
+class Hedger:
+    """
+    Hedged requests for idempotent calls: once `min_samples` latencies are
+    known, a call still running after the `percentile` latency gets a
+    duplicate, and whichever succeeds first is returned. The loser is left to
+    finish in the background; its answer is discarded.
+
+    Both copies run on `pool`; when it has no free thread the call runs on
+    the caller's thread unhedged. `can_hedge()` is asked before each
+    duplicate (e.g. for a spare rate-limit token and concurrency slot), and
+    `hedge_done()` is called when that duplicate finishes, won or lost.
+    """
+
+    def __init__(self, pool: HedgePool, percentile: float, min_samples: int, window: int = 500):
+        self._pool = pool
+        self.percentile = percentile
+        self.min_samples = max(1, min_samples)
+        self._latencies = deque(maxlen=max(window, self.min_samples))
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self) -> float | None:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def call(self, fn, can_hedge=lambda: True, hedge_done=lambda: None):
+        delay = self.hedge_delay()
+        started = time.monotonic()
+        primary = None if delay is None else self._pool.try_submit(fn)
+        if primary is None:
+            result = fn()
+            self._observe(time.monotonic() - started)
+            return result
+
+        done, _ = wait([primary], timeout=delay)
+        hedge = None
+        if not done and can_hedge():
+
+            def duplicate():
+                try:
+                    return fn()
+                finally:
+                    hedge_done()
+
+            hedge = self._pool.try_submit(duplicate)
+            if hedge is None:
+                hedge_done()
+        if hedge is None:
+            result = primary.result()
+            self._observe(time.monotonic() - started)
+            return result
+
+        with self._lock:
+            self.hedged += 1
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    # what the caller waited, which is never below the delay
+                    self._observe(time.monotonic() - started)
+                    return future.result()
+                error = future.exception()
+        raise error
@@ -1,22 +1,49 @@
 from kafka import KafkaConsumer, errors
+from kafka.coordinator.assignors.range import RangePartitionAssignor
+from kafka.coordinator.assignors.roundrobin import RoundRobinPartitionAssignor
 import time
 import json
-from config import KAFKA_TOPIC, KAFKA_BOOTSTRAP_SERVERS
+from config import (
+    KAFKA_TOPIC,
+    KAFKA_BOOTSTRAP_SERVERS,
+    KAFKA_GROUP_ID,
+    KAFKA_REBALANCE_DRAIN_SECONDS,
+)
+from shared.logs import get_logger
 
+log = get_logger(__name__)
 
-def get_consumer_with_retry(retries=5, delay=5):
+
+def get_consumer_with_retry(listener=None, topics=(KAFKA_TOPIC,), retries=5, delay=5):
+    """
+    Join KAFKA_GROUP_ID on `topics`. `listener` is a
+    ConsumerRebalanceListener told about partitions moving between members.
+    """
     for attempt in range(retries):
         try:
-            return KafkaConsumer(
-                KAFKA_TOPIC,
+            consumer = KafkaConsumer(
                 bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
                 value_deserializer=lambda m: json.loads(m.decode("utf-8")),
                 auto_offset_reset="earliest",
-                group_id="trip_worker_group",
+                group_id=KAFKA_GROUP_ID,
+                # offsets are committed by main.run() once results are persisted
+                enable_auto_commit=False,
+                # round robin spreads partitions evenly across processes; range
+                # stays listed so members running older code can still agree
+                partition_assignment_strategy=(
+                    RoundRobinPartitionAssignor,
+                    RangePartitionAssignor,
+                ),
+                # also the rebalance timeout; leave room for draining tasks
+                max_poll_interval_ms=max(
+                    300000, int((KAFKA_REBALANCE_DRAIN_SECONDS + 60) * 1000)
+                ),
             )
+            consumer.subscribe(list(topics), listener=listener)
+            return consumer
         except errors.NoBrokersAvailable:
-            print(
-                f"[Kafka] No brokers available, retrying... ({attempt + 1}/{retries})"
+            log.warning(
+                "[Kafka] No brokers available, retrying (%d/%d)", attempt + 1, retries
             )
             time.sleep(delay)
     raise RuntimeError("Kafka is not available after retries")
@@ -0,0 +1,113 @@
+from collections import deque
+
+
+class Lane:
+    """
+    One priority lane: a Kafka topic, its weight, and the records fetched
+    from it that have not been started yet. `max_slots` caps what the lane
+    may borrow while the other lanes are idle (None: the whole capacity).
+    """
+
+    def __init__(self, name: str, topic: str, weight: float, max_slots: int = None):
+        self.name = name
+        self.topic = topic
+        self.weight = weight
+        self.max_slots = max_slots
+        self.share = 1
+        self.queued = deque()  # (partition, record), in fetch order
+        self.in_flight = 0
+        self.lag = 0  # messages still on the broker
+
+
+class LaneScheduler:
+    """
+    Splits `capacity` task slots between lanes. While several lanes have work
+    waiting, each may fill only its weighted share of the slots (at least
+    one, so no lane starves); a lane with nothing waiting lends its slots
+    to the others, up to their `max_slots`. Among lanes allowed to start a
+    task, the one using the least of its weight goes first.
+
+    Records are fetched into per-lane queues and started from there, so the
+    consumer is only asked for as many records as the lanes can take.
+    """
+
+    def __init__(self, lanes: list, capacity: int):
+        self.capacity = capacity
+        self.lanes = lanes
+        self._by_topic = {lane.topic: lane for lane in lanes}
+        total_weight = sum(lane.weight for lane in lanes)
+        for lane in lanes:
+            lane.share = max(1, int(capacity * lane.weight / total_weight))
+            lane.max_slots = min(capacity, lane.max_slots or capacity)
+
+    @property
+    def topics(self) -> list:
+        return [lane.topic for lane in self.lanes]
+
+    def lane_for(self, topic: str) -> Lane:
+        return self._by_topic[topic]
+
+    def _waiting(self, lane: Lane) -> bool:
+        return bool(lane.queued) or lane.lag > 0
+
+    def limit(self, lane: Lane) -> int:
+        if any(self._waiting(other) for other in self.lanes if other is not lane):
+            return min(lane.share, lane.max_slots)
+        return lane.max_slots
+
+    def refresh(self, in_flight_partitions, lag_by_topic: dict = None):
+        """Recount running tasks (by partition) and update broker lag."""
+        for lane in self.lanes:
+            lane.in_flight = 0
+            if lag_by_topic is not None:
+                lane.lag = lag_by_topic.get(lane.topic, 0)
+        for partition in in_flight_partitions:
+            self._by_topic[partition.topic].in_flight += 1
+
+    def add(self, records: dict):
+        """Queue the {partition: [record, ...]} returned by consumer.poll()."""
+        for partition, messages in records.items():
+            queued = self._by_topic[partition.topic].queued
+            queued.extend((partition, msg) for msg in messages)
+
+    def drop(self, partitions):
+        """Forget queued records of partitions this consumer no longer owns."""
+        partitions = set(partitions)
+        for lane in self.lanes:
+            lane.queued = deque(
+                (partition, msg) for partition, msg in lane.queued if partition not in partitions
+            )
+
+    def next(self):
+        """Return (partition, record) to start now, or None."""
+        if sum(lane.in_flight for lane in self.lanes) >= self.capacity:
+            return None
+        ready = [
+            lane
+            for lane in self.lanes
+            if lane.queued and lane.in_flight < self.limit(lane)
+        ]
+        if not ready:
+            return None
+        lane = min(ready, key=lambda lane: lane.in_flight / lane.weight)
+        lane.in_flight += 1
+        return lane.queued.popleft()
+
+    def fetching_topics(self) -> set:
+        """Topics worth fetching: their lane has nothing queued and room left."""
+        return {
+            lane.topic
+            for lane in self.lanes
+            if not lane.queued and lane.in_flight < self.limit(lane)
+        }
+
+    def fetch_budget(self) -> int:
+        """How many records one poll may return without overfilling a lane."""
+        free = self.capacity - sum(lane.in_flight for lane in self.lanes)
+        fetching = self.fetching_topics()
+        room = sum(
+            self.limit(lane) - lane.in_flight
+            for lane in self.lanes
+            if lane.topic in fetching
+        )
+        return max(0, min(free, room))
@@ -1,19 +1,316 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from kafka import ConsumerRebalanceListener
+from kafka.errors import CommitFailedError
+from kafka.structs import OffsetAndMetadata
+
+from batch_writer import BatchWriter
+from config import (
+    WORKER_CONCURRENCY,
+    WORKER_PROCESSES,
+    KAFKA_POLL_TIMEOUT_MS,
+    KAFKA_TOPIC,
+    LANE_WEIGHT_SHORT,
+    LANE_WEIGHT_LONG,
+    LANE_SHORT_RESERVED_SLOTS,
+    KAFKA_REBALANCE_DRAIN_SECONDS,
+    METRICS_PORT,
+    RESULT_BATCH_SIZE,
+    RESULT_BATCH_MAX_DELAY_MS,
+)
+from db import close_pool
+from metrics import (
+    TASK_SECONDS,
+    TASKS,
+    TASKS_IN_FLIGHT,
+    consumer_lag,
+    start_metrics_server,
+    update_consumer_lag,
+)
 from kafka_consumer import get_consumer_with_retry
+from lanes import Lane, LaneScheduler
+from offset_tracker import OffsetTracker
+from result_store import mark_request_failed, write_result_batch
 from task_processor import process_task
+from shared.config import KAFKA_TOPIC_LONG
+from shared.logs import configure_logging, get_logger
+
+log = get_logger(__name__)
+
+_stopping = False
+
+
+def _request_stop(signum, frame):
+    global _stopping
+    _stopping = True
+
+
+def _offset_and_metadata(offset):
+    # kafka-python >= 2.1 added a leader_epoch field to this namedtuple
+    return OffsetAndMetadata._make(
+        (offset, None, -1)[: len(OffsetAndMetadata._fields)]
+    )
+
+
+def handle_message(payload: dict, result_writer=None):
+    request_id = payload.get("request_id")
+    log.info("📥 Consumed message", extra={"request_id": request_id})
+    log.debug("Message payload %s", payload)
+    TASKS_IN_FLIGHT.inc()
+    try:
+        with TASK_SECONDS.time():
+            process_task(payload, result_writer)
+        TASKS.labels("done").inc()
+    except Exception as e:
+        TASKS.labels("failed").inc()
+        log.exception("❌ Processing error", extra={"request_id": request_id})
+        # Record the failure so the request resolves. If that fails too the
+        # exception escapes, the offset is not finished and the message is
+        # redelivered.
+        try:
+            mark_request_failed(request_id, f"Processing failed: {e}")
+        except Exception:
+            log.exception(
+                "Could not record the failure, message will be redelivered",
+                extra={"request_id": request_id},
+            )
+            raise
+    finally:
+        TASKS_IN_FLIGHT.dec()
+
+
+def _commit_finished(consumer, tracker, in_flight) -> dict:
+    """
+    Commit the offsets of finished tasks. A task whose failure could not be
+    recorded is not finished: its offset stays uncommitted, and the lowest
+    such offset per partition is returned so the caller can seek back to it.
+    """
+    unrecorded = {}
+    for future in [f for f in in_flight if f.done()]:
+        partition, offset = in_flight.pop(future)
+        if future.exception() is not None:
+            tracker.fail(partition, offset)
+            unrecorded[partition] = min(offset, unrecorded.get(partition, offset))
+        else:
+            tracker.finish(partition, offset)
+    commits = tracker.committable()
+    if commits:
+        consumer.commit(
+            {tp: _offset_and_metadata(offset) for tp, offset in commits.items()}
+        )
+    return unrecorded
+
+
+class _RebalanceHandler(ConsumerRebalanceListener):
+    """
+    Before a partition moves to another group member, let its in-flight tasks
+    finish (up to KAFKA_REBALANCE_DRAIN_SECONDS, which covers a task's
+    deadline) and commit them, so the new owner does not plan the same trips
+    again. Runs inside consumer.poll().
+
+    A task still running after the drain keeps its in_flight entry; if its
+    partition comes back to this consumer, run() skips the refetched record.
+    """
 
+    def __init__(self, tracker, in_flight, scheduler):
+        self.consumer = None  # set once the consumer exists
+        self.tracker = tracker
+        self.in_flight = in_flight
+        self.scheduler = scheduler
 
-def run():
-    print("👷 TripPlannerService worker started, waiting for messages...")
-    consumer = get_consumer_with_retry()
-    for msg in consumer:
-        payload = msg.value
-        print(f"📥 Consumed message: {payload}")
+    def on_partitions_revoked(self, revoked):
+        revoked = set(revoked)
+        if not revoked or self.consumer is None:
+            return
+        # not started yet, so the new owner fetches them again
+        self.scheduler.drop(revoked)
+        draining = [f for f, (tp, _offset) in self.in_flight.items() if tp in revoked]
+        log.info(
+            "🔀 Partitions revoked, draining their tasks",
+            extra={"partitions": sorted(str(tp) for tp in revoked), "in_flight": len(draining)},
+        )
+        wait(draining, timeout=KAFKA_REBALANCE_DRAIN_SECONDS)
         try:
-            process_task(payload)
-            print(f"✅ Completed processing: {payload['request_id']}")
-        except Exception as e:
-            print(f"❌ Processing error for {payload.get('request_id')}: {e}")
+            _commit_finished(self.consumer, self.tracker, self.in_flight)
+        except CommitFailedError as e:
+            # already removed from the group; the new owner redoes these
+            log.warning("Commit before rebalance failed", extra={"error": str(e)})
+        for tp in revoked:
+            self.tracker.forget(tp)
+
+    def on_partitions_assigned(self, assigned):
+        log.info(
+            "🔀 Partitions assigned",
+            extra={"partitions": sorted(str(tp) for tp in assigned)},
+        )
+
+
+def _lanes() -> LaneScheduler:
+    lanes = [Lane("short", KAFKA_TOPIC, LANE_WEIGHT_SHORT)]
+    if KAFKA_TOPIC_LONG:
+        lanes.append(
+            Lane(
+                "long",
+                KAFKA_TOPIC_LONG,
+                LANE_WEIGHT_LONG,
+                max_slots=max(1, WORKER_CONCURRENCY - LANE_SHORT_RESERVED_SLOTS),
+            )
+        )
+    return LaneScheduler(lanes, WORKER_CONCURRENCY)
+
+
+def _lag_by_topic(lag: dict) -> dict:
+    """Sum a metrics.consumer_lag() result per topic."""
+    by_topic = {}
+    for tp, messages in lag.items():
+        by_topic[tp.topic] = by_topic.get(tp.topic, 0) + messages
+    return by_topic
+
+
+def _apply_fetch_plan(consumer, scheduler):
+    """Pause the partitions of lanes that cannot take more work right now."""
+    fetching = scheduler.fetching_topics()
+    assignment = consumer.assignment()
+    paused = consumer.paused()
+    to_pause = [tp for tp in assignment if tp.topic not in fetching and tp not in paused]
+    to_resume = [tp for tp in paused if tp.topic in fetching]
+    if to_pause:
+        consumer.pause(*to_pause)
+    if to_resume:
+        consumer.resume(*to_resume)
+
+
+def run(process_index: int = 0):
+    configure_logging("logic-worker")
+    log.info(
+        "👷 TripPlannerService worker started, waiting for messages...",
+        extra={"concurrency": WORKER_CONCURRENCY, "process": process_index},
+    )
+    signal.signal(signal.SIGTERM, _request_stop)
+    if METRICS_PORT > 0:
+        start_metrics_server(METRICS_PORT + process_index)
+    tracker = OffsetTracker()
+    in_flight = {}  # future -> (partition, offset)
+    scheduler = _lanes()
+    rebalance = _RebalanceHandler(tracker, in_flight, scheduler)
+    consumer = get_consumer_with_retry(rebalance, topics=scheduler.topics)
+    rebalance.consumer = consumer
+    executor = ThreadPoolExecutor(
+        max_workers=WORKER_CONCURRENCY, thread_name_prefix="task"
+    )
+    # Batching only pays off when several tasks finish around the same time
+    result_writer = None
+    if WORKER_CONCURRENCY > 1 and RESULT_BATCH_SIZE > 1:
+        result_writer = BatchWriter(
+            write_result_batch, RESULT_BATCH_SIZE, RESULT_BATCH_MAX_DELAY_MS / 1000
+        )
+
+    try:
+        while not _stopping:
+            lag = consumer_lag(consumer)
+            scheduler.refresh(
+                (partition for partition, _offset in in_flight.values()),
+                _lag_by_topic(lag),
+            )
+            _apply_fetch_plan(consumer, scheduler)
+            budget = scheduler.fetch_budget()
+            if budget > 0:
+                records = consumer.poll(
+                    timeout_ms=KAFKA_POLL_TIMEOUT_MS, max_records=budget
+                )
+            else:
+                # No lane can take more: keep polling (everything is paused)
+                # so the consumer stays in the group while tasks finish.
+                wait(
+                    in_flight,
+                    timeout=KAFKA_POLL_TIMEOUT_MS / 1000,
+                    return_when=FIRST_COMPLETED,
+                )
+                records = consumer.poll(timeout_ms=0)
+            scheduler.add(records)
+
+            # slots of tasks that finished meanwhile go to whichever lane is next
+            scheduler.refresh(
+                partition for future, (partition, _offset) in in_flight.items()
+                if not future.done()
+            )
+            running = set(in_flight.values())
+            started = scheduler.next()
+            while started is not None:
+                partition, msg = started
+                if (partition, msg.offset) in running or tracker.is_active(
+                    partition, msg.offset
+                ):
+                    # refetched after a seek or a rebalance; already running or done
+                    scheduler.lane_for(partition.topic).in_flight -= 1
+                else:
+                    tracker.start(partition, msg.offset)
+                    future = executor.submit(handle_message, msg.value, result_writer)
+                    in_flight[future] = (partition, msg.offset)
+                started = scheduler.next()
+
+            # A task finishes once its result, or its failure, is written to
+            # the requests table, so committing never acknowledges a request
+            # that would otherwise stay pending. Tasks whose failure could not
+            # be written are fetched again from their offset.
+            for partition, offset in _commit_finished(consumer, tracker, in_flight).items():
+                scheduler.drop([partition])
+                consumer.seek(partition, offset)
+            update_consumer_lag(lag)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.info("🛑 Draining in-flight tasks before shutdown", extra={"in_flight": len(in_flight)})
+        wait(in_flight)
+        _commit_finished(consumer, tracker, in_flight)
+        executor.shutdown(wait=True)
+        if result_writer is not None:
+            result_writer.close()
+        consumer.close()
+        close_pool()
+
+
+def supervise(processes: int):
+    """
+    Run `processes` consumers of the same group, restarting any that die.
+    SIGTERM/SIGINT are passed on so each child drains before exiting.
+    """
+    configure_logging("logic-worker")
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    # spawn, not fork: children must not inherit the parent's logging thread
+    context = multiprocessing.get_context("spawn")
+    children = {}
+
+    def start(index):
+        child = context.Process(target=run, args=(index,), name=f"worker-{index}")
+        child.start()
+        children[index] = child
+
+    for index in range(processes):
+        start(index)
+    log.info("👷 Supervising worker processes", extra={"processes": processes})
+    while not _stopping:
+        time.sleep(1)
+        for index, child in list(children.items()):
+            if not child.is_alive() and not _stopping:
+                log.warning(
+                    "Worker process exited, restarting",
+                    extra={"process": index, "exitcode": child.exitcode},
+                )
+                start(index)
+    for child in children.values():
+        if child.is_alive():
+            child.terminate()  # SIGTERM: the child drains and commits first
+    for child in children.values():
+        child.join()
 
 
 if __name__ == "__main__":
-    run()
+    if WORKER_PROCESSES > 1:
+        supervise(WORKER_PROCESSES)
+    else:
+        run()
@@ -0,0 +1,138 @@
+import time
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from config import METRICS_PORT, CONSUMER_LAG_INTERVAL_SECONDS
+from external_apis import get_cache_stats, get_hedge_stats, get_limiter_stats
+from shared.logs import get_logger
+
+log = get_logger(__name__)
+
+# process_task stages; labels are bound up front so timing one is a lookup
+STAGES = ("llm", "parse", "route", "photo_lookup", "photos", "persist")
+
+STAGE_SECONDS = Histogram(
+    "worker_stage_duration_seconds",
+    "Time spent in each process_task stage. photo_lookup is one Places "
+    "lookup; photos is the whole enrichment step, including waiting on them.",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80),
+)
+_stage_timers = {stage: STAGE_SECONDS.labels(stage) for stage in STAGES}
+
+TASK_SECONDS = Histogram(
+    "worker_task_duration_seconds",
+    "End-to-end process_task time.",
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300),
+)
+TASKS = Counter("worker_tasks", "Finished tasks by outcome.", ["outcome"])
+DEGRADED = Counter(
+    "worker_degraded_tasks",
+    "Tasks that ran out of time in a stage and finished without its output.",
+    ["stage"],
+)
+TASKS_IN_FLIGHT = Gauge("worker_tasks_in_flight", "Tasks currently being processed.")
+CONSUMER_LAG = Gauge(
+    "worker_consumer_lag",
+    "Messages behind the partition high watermark.",
+    ["topic", "partition"],
+)
+
+
+def time_stage(stage: str):
+    """Context manager observing the block's duration under `stage`."""
+    return _stage_timers[stage].time()
+
+
+_lag_updated_at = 0.0
+
+
+def consumer_lag(consumer) -> dict:
+    """
+    {partition: messages behind the high watermark}, from the consumer's
+    cached fetch metadata so no broker round trip is made. Partitions
+    nothing has been fetched from yet are left out.
+    """
+    lag = {}
+    for tp in consumer.assignment():
+        highwater = consumer.highwater(tp)
+        if highwater is not None:
+            lag[tp] = max(0, highwater - consumer.position(tp))
+    return lag
+
+
+def update_consumer_lag(lag: dict):
+    """Publish a consumer_lag() result; throttled to CONSUMER_LAG_INTERVAL_SECONDS."""
+    global _lag_updated_at
+    now = time.monotonic()
+    if now - _lag_updated_at < CONSUMER_LAG_INTERVAL_SECONDS:
+        return
+    _lag_updated_at = now
+    for tp, messages in lag.items():
+        CONSUMER_LAG.labels(tp.topic, str(tp.partition)).set(messages)
+
+
+class _CacheCollector:
+    """external_apis cache counters, read only when Prometheus scrapes."""
+
+    def collect(self):
+        counters = {
+            key: CounterMetricFamily(
+                f"worker_cache_{key}", f"Cache {key.replace('_', ' ')}.", labels=["cache"]
+            )
+            for key in ("memory_hits", "store_hits", "misses", "evictions", "store_errors")
+        }
+        size = GaugeMetricFamily(
+            "worker_cache_size", "Entries in the in-process tier.", labels=["cache"]
+        )
+        for name, stats in get_cache_stats().items():
+            for key, family in counters.items():
+                family.add_metric([name], stats[key])
+            size.add_metric([name], stats["size"])
+        yield from counters.values()
+        yield size
+
+
+class _LimiterCollector:
+    """AIMD concurrency limit and calls in flight per provider, and hedging."""
+
+    def collect(self):
+        limit = GaugeMetricFamily(
+            "worker_provider_concurrency_limit",
+            "Adaptive limit on concurrent calls.",
+            labels=["provider"],
+        )
+        in_flight = GaugeMetricFamily(
+            "worker_provider_in_flight", "Calls currently in flight.", labels=["provider"]
+        )
+        hedged = CounterMetricFamily(
+            "worker_hedged_requests",
+            "Duplicate Google requests sent for slow calls.",
+            labels=["endpoint"],
+        )
+        hedge_wins = CounterMetricFamily(
+            "worker_hedge_wins",
+            "Hedged calls where the duplicate answered first.",
+            labels=["endpoint"],
+        )
+        for name, stats in get_limiter_stats().items():
+            limit.add_metric([name], stats["concurrency_limit"])
+            in_flight.add_metric([name], stats["in_flight"])
+        for endpoint, stats in get_hedge_stats().items():
+            hedged.add_metric([endpoint], stats["hedged"])
+            hedge_wins.add_metric([endpoint], stats["hedge_wins"])
+        yield limit
+        yield in_flight
+        yield hedged
+        yield hedge_wins
+
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """Serve /metrics on `port` in a background thread (0 disables)."""
+    if port <= 0:
+        return
+    REGISTRY.register(_CacheCollector())
+    REGISTRY.register(_LimiterCollector())
+    start_http_server(port)
+    log.info("📈 Metrics on :%d/metrics", port)
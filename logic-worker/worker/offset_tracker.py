@@ -0,0 +1,55 @@
+class OffsetTracker:
+    """
+    Tracks in-flight Kafka offsets per partition when messages finish out of
+    order. An offset only becomes committable once it and every earlier
+    offset on the same partition are finished, so a crash never skips work.
+    """
+
+    def __init__(self):
+        # partition -> {offset: finished?}, in the order the offsets arrived;
+        # None marks a failed offset waiting to be redelivered
+        self._offsets = {}
+
+    def start(self, partition, offset):
+        self._offsets.setdefault(partition, {})[offset] = False
+
+    def finish(self, partition, offset):
+        pending = self._offsets.get(partition)
+        if pending is not None and offset in pending:
+            pending[offset] = True
+
+    def fail(self, partition, offset):
+        """Keep `offset` (and everything after it) uncommitted until it is redone."""
+        pending = self._offsets.get(partition)
+        if pending is not None and offset in pending:
+            pending[offset] = None
+
+    def is_active(self, partition, offset) -> bool:
+        """True if `offset` is running or finished, so a redelivered copy is skipped."""
+        pending = self._offsets.get(partition)
+        return pending is not None and pending.get(offset, None) is not None
+
+    def in_flight(self) -> int:
+        return sum(
+            1 for pending in self._offsets.values() for done in pending.values() if done is False
+        )
+
+    def committable(self) -> dict:
+        """
+        Pop the finished prefix of each partition and return
+        {partition: next_offset_to_consume} for partitions that advanced.
+        """
+        commits = {}
+        for partition, pending in self._offsets.items():
+            last_done = None
+            for offset in list(pending):
+                if not pending[offset]:
+                    break
+                del pending[offset]
+                last_done = offset
+            if last_done is not None:
+                commits[partition] = last_done + 1
+        return commits
+
+    def forget(self, partition):
+        self._offsets.pop(partition, None)
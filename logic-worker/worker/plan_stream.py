@@ -0,0 +1,72 @@
+import json
+
+
+class IncrementalDaysParser:
+    """
+    Pulls complete day objects out of a plan JSON while it is still being
+    streamed. Feed it text chunks; each call returns the `days` entries that
+    were completed by that chunk. Only the top-level `days` array is tracked.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.days = []
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None  # last string literal seen directly in the root object
+        self._in_days = False
+        self._days_done = False
+        self._day_start = None
+
+    def feed(self, chunk: str) -> list:
+        self.text += chunk
+        text = self.text
+        new_days = []
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = text[self._string_start + 1 : i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                if (
+                    ch == "["
+                    and self._depth == 1
+                    and self._last_key == "days"
+                    and not self._days_done
+                ):
+                    self._in_days = True
+                elif ch == "{" and self._in_days and self._depth == 2:
+                    self._day_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if not self._in_days:
+                    continue
+                if ch == "}" and self._depth == 2 and self._day_start is not None:
+                    try:
+                        day = json.loads(text[self._day_start : i + 1])
+                    except json.JSONDecodeError:
+                        day = None
+                    if isinstance(day, dict):
+                        self.days.append(day)
+                        new_days.append(day)
+                    self._day_start = None
+                elif ch == "]" and self._depth == 1:
+                    self._in_days = False
+                    self._days_done = True
+        self._pos = len(text)
+        return new_days
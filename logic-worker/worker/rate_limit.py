@@ -0,0 +1,333 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from deadline import NO_DEADLINE, Deadline, DeadlineExceeded
+from shared.logs import get_logger
+
+log = get_logger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most
+    `burst`. A rate <= 0 disables limiting.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Take a token if one is available; else return seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, deadline: Deadline = NO_DEADLINE):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take()
+            if wait <= 0:
+                return
+            _sleep_within(wait, deadline, "rate limit")
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is available right now."""
+        return self.rate <= 0 or self._take() <= 0
+
+
+class SharedTokenBucket:
+    """
+    Token bucket kept in the state DB's rate_limits table so every worker
+    replica draws from one quota. Tokens are leased `lease` at a time to keep
+    it to one round trip per lease rather than per call. If the database is
+    unreachable the bucket uses `fallback` (a process-local bucket holding
+    this process's share of the quota) for `retry_seconds` before trying
+    the database again.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        rate: float,
+        burst: float,
+        lease: int,
+        get_connection,
+        fallback: TokenBucket = None,
+        retry_seconds: float = 30.0,
+    ):
+        self.provider = provider
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.lease = max(1, lease)
+        self.retry_seconds = retry_seconds
+        self._get_connection = get_connection
+        self._leased = 0
+        self._lock = threading.Lock()
+        self._fallback = fallback or TokenBucket(rate, burst)
+        self._initialized = False
+        self._unavailable_until = 0.0
+
+    def _lease_tokens(self):
+        """Returns (tokens granted, seconds until the next one)."""
+        with self._get_connection() as conn:
+            with conn.cursor() as cur:
+                if not self._initialized:
+                    cur.execute(
+                        """
+                        INSERT INTO rate_limits (provider, tokens)
+                        VALUES (%s, %s)
+                        ON CONFLICT (provider) DO NOTHING
+                        """,
+                        (self.provider, self.burst),
+                    )
+                cur.execute(
+                    """
+                    WITH current AS (
+                        SELECT provider,
+                               LEAST(%(burst)s, tokens + EXTRACT(EPOCH FROM clock_timestamp() - updated_at) * %(rate)s) AS available
+                          FROM rate_limits
+                         WHERE provider = %(provider)s
+                           FOR UPDATE
+                    )
+                    UPDATE rate_limits AS r
+                       SET tokens = current.available - LEAST(%(lease)s, FLOOR(current.available)),
+                           updated_at = clock_timestamp()
+                      FROM current
+                     WHERE r.provider = current.provider
+                    RETURNING LEAST(%(lease)s, FLOOR(current.available))::int, r.tokens
+                    """,
+                    {
+                        "provider": self.provider,
+                        "rate": self.rate,
+                        "burst": self.burst,
+                        "lease": self.lease,
+                    },
+                )
+                row = cur.fetchone()
+        if row is None:
+            # the row was deleted behind our back; insert it again next time
+            self._initialized = False
+            raise RuntimeError(f"rate_limits has no row for {self.provider}")
+        self._initialized = True  # only once the INSERT has been committed
+        granted, remaining = row
+        return granted, 0.0 if granted else (1 - remaining) / self.rate
+
+    def acquire(self, deadline: Deadline = NO_DEADLINE):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                if self._leased > 0:
+                    self._leased -= 1
+                    return
+                if time.monotonic() < self._unavailable_until:
+                    granted, wait = None, 0.0
+                else:
+                    try:
+                        granted, wait = self._lease_tokens()
+                    except Exception as e:
+                        # warn once per outage window, not on every call
+                        self._unavailable_until = time.monotonic() + self.retry_seconds
+                        log.warning(
+                            "Shared rate limit unavailable, using local bucket",
+                            extra={
+                                "provider": self.provider,
+                                "retry_in_s": self.retry_seconds,
+                                "error": str(e),
+                            },
+                        )
+                        granted, wait = None, 0.0
+                if granted:
+                    self._leased = granted - 1
+                    return
+            if granted is None:
+                return self._fallback.acquire(deadline)
+            _sleep_within(wait, deadline, "rate limit")
+
+    def try_acquire(self) -> bool:
+        """Take an already leased token; never waits on the database."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            if self._leased > 0:
+                self._leased -= 1
+                return True
+        return False
+
+
+def _sleep_within(seconds: float, deadline: Deadline, waiting_for: str):
+    remaining = deadline.remaining()
+    if remaining is not None and seconds > remaining:
+        raise DeadlineExceeded(f"{waiting_for} wait would pass the deadline")
+    time.sleep(seconds)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on calls in flight: each success raises the limit by
+    1/limit (about +1 per window of calls) and a throttling response halves
+    it, at most once per `cooldown_seconds` so one burst of 429s counts once.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        decrease_ratio: float = 0.5,
+        cooldown_seconds: float = 1.0,
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease_ratio = decrease_ratio
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, deadline: Deadline = NO_DEADLINE):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline.remaining()
+                if remaining is not None and remaining <= 0:
+                    raise DeadlineExceeded("no concurrency slot before the deadline")
+                self._cond.wait(remaining)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.release()
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now; pair with release()."""
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            if self.limit < self.maximum:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self._cond.notify()
+
+    def on_throttled(self):
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown_seconds:
+                return
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit * self.decrease_ratio)
+
+
+class Retryable(Exception):
+    """
+    Raised by a classifier for failures worth retrying. `throttled` marks
+    quota/429 responses, which also shrink the concurrency limit.
+    """
+
+    def __init__(self, cause: Exception, throttled: bool = False, retry_after: float = None):
+        super().__init__(str(cause))
+        self.cause = cause
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+
+class ProviderLimiter:
+    """
+    Rate limit, adaptive concurrency and jittered retry for one external
+    provider. `classify(exc)` returns a Retryable for transient failures and
+    None for everything else, which is raised straight away.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        bucket,
+        concurrency: AdaptiveConcurrency,
+        classify,
+        max_attempts: int,
+        base_delay_seconds: float,
+        max_delay_seconds: float,
+    ):
+        self.name = name
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.classify = classify
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        """Full jitter, but never sooner than the server's Retry-After."""
+        cap = min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (attempt - 1))
+        delay = random.uniform(0, cap)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay_seconds))
+        return delay
+
+    def call(self, fn, hold_slot: bool = True, deadline: Deadline = NO_DEADLINE):
+        """
+        Run `fn()` under the limits, retrying transient failures. Pass
+        hold_slot=False when the caller already holds a concurrency slot.
+        Waits and retries stop at `deadline` with DeadlineExceeded; `fn`
+        should derive its own timeout from it too.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self.bucket.acquire(deadline)
+            try:
+                if hold_slot:
+                    with self.concurrency.slot(deadline):
+                        result = fn()
+                else:
+                    result = fn()
+            except Exception as e:
+                retry = self.classify(e)
+                if retry is None:
+                    raise
+                if retry.throttled:
+                    self.concurrency.on_throttled()
+                if attempt == self.max_attempts:
+                    raise
+                delay = self.backoff(attempt, retry.retry_after)
+                remaining = deadline.remaining()
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceeded(
+                        f"{self.name} call out of time after {attempt} attempts"
+                    ) from e
+                log.info(
+                    "Retrying %s call",
+                    self.name,
+                    extra={
+                        "attempt": attempt,
+                        "delay_s": round(delay, 3),
+                        "throttled": retry.throttled,
+                        "error": str(e),
+                    },
+                )
+                time.sleep(delay)
+                continue
+            self.concurrency.on_success()
+            return result
@@ -0,0 +1,288 @@
+import json
+
+from psycopg2.extras import execute_values
+
+from config import (
+    PLAN_CACHE_ENABLED,
+    PLAN_CACHE_MAX_ENTRIES,
+    PLAN_CACHE_TTL_SECONDS,
+    REQUEST_RETENTION_SECONDS,
+    ROUTE_DETAILS_TTL_SECONDS,
+)
+from db import get_connection
+from shared.fingerprint import trip_fingerprint, content_hash
+from shared.logs import get_logger
+
+log = get_logger(__name__)
+
+# plan_cache trims beyond PLAN_CACHE_MAX_ENTRIES every this many inserts
+_PLAN_CACHE_PRUNE_EVERY = 200
+_plan_cache_inserts = 0
+# old finished requests are deleted every this many completed requests; each
+# sweep deletes at most _PRUNE_LIMIT rows so the transaction stays short
+_REQUEST_PRUNE_EVERY = 200
+_PRUNE_LIMIT = 5000
+_requests_completed = 0
+# unused route_details past ROUTE_DETAILS_TTL_SECONDS go every this many inserts
+_ROUTE_DETAILS_PRUNE_EVERY = 200
+_route_details_inserts = 0
+
+
+def cache_plan(cur, message: dict, plan: dict, degraded: tuple = ()):
+    """
+    Publish a finished plan to the cross-user plan_cache so equivalent
+    requests can skip OpenAI. Plans with `degraded` stages (photos or route
+    left out for lack of time) are only given to their own requesters.
+    Runs on the caller's cursor/transaction.
+    """
+    global _plan_cache_inserts
+    if not PLAN_CACHE_ENABLED or degraded or "error" in plan or not plan.get("days"):
+        return
+    fingerprint = trip_fingerprint(
+        message["start_location"],
+        message["start_date"],
+        message["end_date"],
+        message.get("interests", []),
+    )
+    cur.execute(
+        """
+        INSERT INTO plan_cache (fingerprint, plan)
+        VALUES (%s, %s)
+        ON CONFLICT (fingerprint) DO UPDATE
+           SET plan = EXCLUDED.plan,
+               created_at = CURRENT_TIMESTAMP,
+               last_used_at = CURRENT_TIMESTAMP
+        """,
+        (fingerprint, json.dumps(plan)),
+    )
+    _plan_cache_inserts += 1
+    if _plan_cache_inserts % _PLAN_CACHE_PRUNE_EVERY == 0:
+        cur.execute(
+            """
+            DELETE FROM plan_cache
+             WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                OR fingerprint IN (
+                    SELECT fingerprint FROM plan_cache
+                     ORDER BY last_used_at DESC
+                    OFFSET %s
+                )
+            """,
+            (PLAN_CACHE_TTL_SECONDS, PLAN_CACHE_MAX_ENTRIES),
+        )
+
+
+def prune_requests(cur, completed: int):
+    """
+    Delete done/error requests older than REQUEST_RETENTION_SECONDS, once
+    every _REQUEST_PRUNE_EVERY completed requests. Runs on the caller's
+    cursor/transaction.
+    """
+    global _requests_completed
+    before = _requests_completed
+    _requests_completed += completed
+    if _requests_completed // _REQUEST_PRUNE_EVERY == before // _REQUEST_PRUNE_EVERY:
+        return
+    cur.execute(
+        """
+        DELETE FROM requests
+         WHERE request_id IN (
+            SELECT request_id FROM requests
+             WHERE status <> 'pending'
+               AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+             LIMIT %s
+        )
+        """,
+        (REQUEST_RETENTION_SECONDS, _PRUNE_LIMIT),
+    )
+    if cur.rowcount:
+        log.info("Pruned finished requests", extra={"deleted": cur.rowcount})
+
+
+def store_route_details(cur, route_details: dict):
+    """
+    Upsert {route_key: directions JSON}, refreshing last_used_at of routes
+    already stored, and now and then delete those unused for
+    ROUTE_DETAILS_TTL_SECONDS. Runs on the caller's cursor/transaction.
+    """
+    global _route_details_inserts
+    if not route_details:
+        return
+    execute_values(
+        cur,
+        """
+        INSERT INTO route_details (route_key, directions)
+        VALUES %s
+        ON CONFLICT (route_key) DO UPDATE
+           SET last_used_at = CURRENT_TIMESTAMP
+        """,
+        list(route_details.items()),
+    )
+    before = _route_details_inserts
+    _route_details_inserts += len(route_details)
+    every = _ROUTE_DETAILS_PRUNE_EVERY
+    if _route_details_inserts // every == before // every:
+        return
+    cur.execute(
+        """
+        DELETE FROM route_details
+         WHERE route_key IN (
+            SELECT route_key FROM route_details
+             WHERE last_used_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+             LIMIT %s
+        )
+        """,
+        (ROUTE_DETAILS_TTL_SECONDS, _PRUNE_LIMIT),
+    )
+    if cur.rowcount:
+        log.info("Pruned unused route details", extra={"deleted": cur.rowcount})
+
+
+def _trip_row(user_id: int, trip_request: dict, plan_json: str, plan_hash: str):
+    destination = trip_request.get("start_location")
+    start_date = trip_request.get("start_date")
+    end_date = trip_request.get("end_date")
+    interests = trip_request.get("interests", [])
+    if not destination or not start_date or not end_date:
+        log.warning("Trip data missing required fields", extra={"trip": trip_request})
+        return None
+    return (
+        user_id,
+        destination,
+        start_date,
+        end_date,
+        json.dumps(interests),
+        plan_json,
+        trip_fingerprint(destination, start_date, end_date, interests, by_dates=True),
+        plan_hash,
+    )
+
+
+def write_results(cur, items: list):
+    """
+    Persist finished tasks on the caller's cursor/transaction. Each item is
+    (message, plan, route_detail, degraded), where route_detail is an optional
+    (detail_key, full Directions response) and degraded names the stages
+    process_task had to leave out.
+
+    Every request (and any identical requests coalesced onto it) is marked
+    done, trips are saved to each requesting user's history and plans are
+    published to the shared plan cache. The advisory locks match the one
+    /submit takes before joining a leader; they are taken in sorted order so
+    concurrent batches cannot deadlock.
+    """
+    request_ids = [message["request_id"] for message, _plan, _detail, _degraded in items]
+    cur.execute(
+        """
+        SELECT DISTINCT fingerprint
+          FROM requests
+         WHERE request_id = ANY(%s::uuid[]) AND fingerprint IS NOT NULL
+        """,
+        (request_ids,),
+    )
+    fingerprints = sorted(row[0] for row in cur.fetchall())
+    if fingerprints:
+        cur.execute(
+            "SELECT pg_advisory_xact_lock(hashtext(f)) FROM unnest(%s::text[]) AS f",
+            (fingerprints,),
+        )
+
+    results = {}  # request_id -> (plan_json, plan_hash, plan)
+    for message, plan, _detail, _degraded in items:
+        results[message["request_id"]] = (json.dumps(plan), content_hash(plan), plan)
+    completed = execute_values(
+        cur,
+        """
+        UPDATE requests AS r
+           SET status = 'done',
+               result = v.result::jsonb,
+               result_hash = v.result_hash,
+               partial_result = NULL
+          FROM (VALUES %s) AS v (request_id, result, result_hash)
+         WHERE (r.request_id = v.request_id::uuid
+                OR r.leader_request_id = v.request_id::uuid)
+           AND r.status = 'pending'
+        RETURNING v.request_id, r.user_id, r.payload
+        """,
+        [(rid, plan_json, plan_hash) for rid, (plan_json, plan_hash, _p) in results.items()],
+        fetch=True,
+    )
+
+    # keyed on (user_id, fingerprint): a user who submitted the same trip
+    # twice is both leader and follower, but gets one trip and history entry
+    trip_rows = {}
+    for request_id, user_id, payload in completed:
+        plan_json, plan_hash, plan = results[request_id]
+        if "error" in plan:
+            continue
+        row = _trip_row(user_id, json.loads(payload), plan_json, plan_hash)
+        if row is not None:
+            trip_rows.setdefault((row[0], row[6]), row)
+    trip_rows = list(trip_rows.values())
+    if trip_rows:
+        saved = execute_values(
+            cur,
+            """
+            INSERT INTO trips (user_id, destination, start_date, end_date, interests, raw_plan, fingerprint, plan_hash)
+            VALUES %s
+            RETURNING user_id, trip_id
+            """,
+            trip_rows,
+            fetch=True,
+        )
+        execute_values(cur, "INSERT INTO history (user_id, trip_id) VALUES %s", saved)
+
+    route_details = {
+        detail[0]: json.dumps(detail[1])
+        for _message, _plan, detail, _degraded in items
+        if detail is not None
+    }
+    store_route_details(cur, route_details)
+
+    for message, plan, _detail, degraded in items:
+        cache_plan(cur, message, plan, degraded)
+    prune_requests(cur, len(items))
+
+
+def mark_request_failed(request_id: str, reason: str):
+    """
+    Fail a pending request together with any requests coalesced onto it, so
+    /status and the event stream resolve instead of waiting forever.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT pg_advisory_xact_lock(hashtext(fingerprint))
+                  FROM requests
+                 WHERE request_id = %s AND fingerprint IS NOT NULL
+                """,
+                (request_id,),
+            )
+            cur.execute(
+                """
+                UPDATE requests
+                   SET status = 'error',
+                       result = %s,
+                       partial_result = NULL
+                 WHERE (request_id = %s OR leader_request_id = %s)
+                   AND status = 'pending'
+                """,
+                (json.dumps({"error": reason}), request_id, request_id),
+            )
+
+
+def write_result_batch(items: list):
+    """Write a batch of (message, plan, route_detail, degraded) in one transaction."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            write_results(cur, items)
+
+
+def persist_result(
+    message: dict, plan: dict, route_detail: tuple = None, degraded: tuple = ()
+):
+    """
+    Atomically mark the request done and save its trips, history, route
+    detail and plan cache entry. See write_results.
+    """
+    write_result_batch([(message, plan, route_detail, degraded)])
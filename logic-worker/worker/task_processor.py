@@ -1,25 +1,181 @@
 import json
-import psycopg2
-import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
 from external_apis import (
     fetch_plan_from_openai,
-    get_google_route,
-    find_place_photo_reference,
+    stream_plan_from_openai,
+    get_route_for_waypoints,
+    route_key,
+    compact_route,
     get_google_place_photo,
-    extract_landmark_name,
 )
-from config import STATE_DB_URL
+from config import (
+    PHOTO_ENRICH_CONCURRENCY,
+    PLAN_STREAMING_ENABLED,
+    PARTIAL_RESULT_MIN_INTERVAL_SECONDS,
+    ROUTE_STORE_DETAIL,
+    TASK_DEADLINE_SECONDS,
+    PERSIST_RESERVE_SECONDS,
+    ROUTE_BUDGET_SECONDS,
+    PHOTO_BUDGET_SECONDS,
+)
+from db import get_connection
+from deadline import NO_DEADLINE, Deadline, DeadlineExceeded
+from metrics import DEGRADED, time_stage
+from plan_stream import IncrementalDaysParser
+from result_store import persist_result
+from shared.logs import RateSampler, get_logger
+
+log = get_logger(__name__)
+# photo lookups fail per slot; log a sample of them rather than every one
+_photo_failure_sampler = RateSampler(20)
+
+SLOTS = ("morning", "noon", "evening")
+
+# Shared by every task in the process, so it also caps total Places traffic
+_photo_executor = ThreadPoolExecutor(
+    max_workers=PHOTO_ENRICH_CONCURRENCY, thread_name_prefix="photo"
+)
+
+
+def _lookup_photo(place_query: str, deadline: Deadline = NO_DEADLINE) -> str:
+    try:
+        with time_stage("photo_lookup"):
+            return get_google_place_photo(place_query, deadline=deadline) or ""
+    except DeadlineExceeded:
+        raise  # enrich_plan_photos counts it as a skipped slot
+    except Exception as e:
+        if _photo_failure_sampler():
+            log.warning(
+                "Photo lookup failed (1 in %d logged)",
+                _photo_failure_sampler.every,
+                extra={"query": place_query, "error": str(e)},
+            )
+        return ""
+
+
+def _slot_entries(days: list, destination: str) -> list:
+    entries = []
+    for day in days:
+        for slot in SLOTS:
+            entry = day.get(slot)
+            if entry:
+                # use the slot’s place_name (or fall back to destination)
+                entries.append((entry, entry.get("place_name", destination)))
+    return entries
+
+
+def prefetch_photos(
+    days: list, destination: str, futures: dict, deadline: Deadline = NO_DEADLINE
+):
+    """Start photo lookups for `days` now, recording them in `futures`."""
+    for _entry, query in _slot_entries(days, destination):
+        if query not in futures:
+            futures[query] = _photo_executor.submit(_lookup_photo, query, deadline)
+
+
+def enrich_plan_photos(
+    plan: dict, destination: str, futures: dict = None, deadline: Deadline = NO_DEADLINE
+) -> int:
+    """
+    Replace every slot's image_url with a Google Places photo.
+    Each distinct place_name is looked up once, and lookups run concurrently.
+    Lookups already started via `prefetch_photos` are reused.
+
+    Slots whose photo is not ready by `deadline` get an empty image_url and
+    the plan is marked `"enrichment": "partial"`. Returns how many slots
+    were left without a lookup result.
+    """
+    futures = {} if futures is None else futures
+    entries = _slot_entries(plan.get("days", []), destination)
+    prefetched = len(futures)
+    prefetch_photos(plan.get("days", []), destination, futures, deadline)
+    log.debug(
+        "🔄 Looking up photos",
+        extra={"photos": len(futures), "slots": len(entries), "prefetched": prefetched},
+    )
+    skipped = 0
+    for entry, query in entries:
+        try:
+            entry["image_url"] = futures[query].result(timeout=deadline.remaining())
+        except (FutureTimeout, DeadlineExceeded):
+            entry["image_url"] = ""
+            skipped += 1
+    if skipped:
+        plan["enrichment"] = "partial"
+        for future in futures.values():
+            future.cancel()  # lookups still queued; running ones stop at the deadline
+    return skipped
+
+
+def save_partial_result(request_id: str, days: list):
+    """Expose the days generated so far to /status while the plan is pending."""
+    partial = {"days": days, "enrichment": "pending"}
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE requests
+                   SET partial_result = %s
+                 WHERE (request_id = %s OR leader_request_id = %s)
+                   AND status = 'pending'
+                """,
+                (json.dumps(partial), request_id, request_id),
+            )
+
+
+def generate_plan_streaming(
+    prompt: str,
+    request_id: str,
+    destination: str,
+    photo_futures: dict,
+    deadline: Deadline = NO_DEADLINE,
+) -> str:
+    """
+    Stream the OpenAI completion, publishing each finished day as a partial
+    result (at most every PARTIAL_RESULT_MIN_INTERVAL_SECONDS) and starting
+    its photo lookups right away. Returns the full completion text.
+    """
+    parser = IncrementalDaysParser()
+    last_saved = 0.0
+    for chunk in stream_plan_from_openai(prompt, deadline):
+        new_days = parser.feed(chunk)
+        if not new_days:
+            continue
+        prefetch_photos(new_days, destination, photo_futures, deadline)
+        if time.monotonic() - last_saved < PARTIAL_RESULT_MIN_INTERVAL_SECONDS:
+            continue
+        try:
+            save_partial_result(request_id, parser.days)
+            last_saved = time.monotonic()
+        except Exception as e:
+            log.warning(
+                "Failed to save partial result",
+                extra={"request_id": request_id, "error": str(e)},
+            )
+    return parser.text
 
 
-def process_task(message: dict):
+def process_task(message: dict, result_writer=None):
     """
     1) Ask OpenAI for a day-by-day plan JSON
     2) (Optionally) fetch a Google Maps route
     3) Enrich each day by swapping out any Wikimedia image_url
     4) Update the requests table in the state DB
+
+    With a `result_writer` (a BatchWriter over result_store.write_result_batch)
+    the result is written as part of a batch; this still returns only once
+    that batch is committed.
+
+    External calls share a TASK_DEADLINE_SECONDS deadline. If the plan itself
+    cannot be generated in time an error result is saved; a route or photos
+    that run out of budget are left out instead, and the stages left out are
+    passed on as `degraded` so the plan is not shared via the plan cache.
     """
-    print("📥 Received:", message)
+    deadline = Deadline(TASK_DEADLINE_SECONDS)
+    # keep time back for saving whatever we have when the calls run long
+    calls = deadline.stage(reserve=PERSIST_RESERVE_SECONDS)
     request_id = message["request_id"]
     destination = message["start_location"]
     start_date = message["start_date"]
@@ -45,72 +201,91 @@ def process_task(message: dict):
         "do not end with .jpg, .jpeg, or .png. If you cannot find a real image, leave "
         "`image_url` as an empty string."
     )
-    plan_text = fetch_plan_from_openai(prompt)
-    print(f"📤 OpenAI response for {request_id}:\n{plan_text}")
+    photo_futures = {}
+    degraded = []
+    try:
+        with time_stage("llm"):
+            if PLAN_STREAMING_ENABLED:
+                plan_text = generate_plan_streaming(
+                    prompt, request_id, destination, photo_futures, calls
+                )
+            else:
+                plan_text = fetch_plan_from_openai(prompt, calls)
+        log.debug("OpenAI response for %s: %s", request_id, plan_text)
+    except DeadlineExceeded as e:
+        DEGRADED.labels("llm").inc()
+        log.warning(
+            "Plan generation ran out of time",
+            extra={"request_id": request_id, "error": str(e)},
+        )
+        plan_text = None
+        for future in photo_futures.values():
+            future.cancel()
 
     # 2) Parse
-    try:
-        plan = json.loads(plan_text)
-        print(f"📦 Parsed plan for {request_id}: {plan}")
-    except json.JSONDecodeError as e:
-        plan = {"error": "Invalid JSON from OpenAI", "details": str(e)}
+    if plan_text is None:
+        plan = {"error": "Timed out generating the plan"}
+    else:
+        try:
+            with time_stage("parse"):
+                plan = json.loads(plan_text)
+        except json.JSONDecodeError as e:
+            log.warning(
+                "Invalid JSON from OpenAI",
+                extra={"request_id": request_id, "error": str(e)},
+            )
+            plan = {"error": "Invalid JSON from OpenAI", "details": str(e)}
 
     # 3) Fetch a Google route between your actual waypoints (optional)
+    # Only a compact route goes into the plan; full detail is stored once per route.
+    route_detail = None
     try:
         wpts = plan.get("waypoints", [])
         if len(wpts) >= 2:
-            origin = f"{wpts[0]['lat']},{wpts[0]['lng']}"
-            destination = f"{wpts[-1]['lat']},{wpts[-1]['lng']}"
-
-            # join any intermediate stops into the `waypoints` param:
-            intermediate = wpts[1:-1]
-            waypoints_param = (
-                "|".join(f"{w['lat']},{w['lng']}" for w in intermediate)
-                if intermediate
-                else None
-            )
-
-            plan["google_route"] = get_google_route(
-                origin, destination, waypoints=waypoints_param
-            )
+            with time_stage("route"):
+                directions = get_route_for_waypoints(
+                    wpts, calls.stage(ROUTE_BUDGET_SECONDS)
+                )
+            detail_key = route_key(wpts) if ROUTE_STORE_DETAIL else None
+            plan["google_route"] = compact_route(directions, detail_key)
+            if detail_key:
+                route_detail = (detail_key, directions)
         else:
             plan["google_route"] = None
     except Exception as e:
-        print("Failed to fetch route:", e)
+        if isinstance(e, DeadlineExceeded):
+            DEGRADED.labels("route").inc()
+        degraded.append("route")
+        log.warning(
+            "Failed to fetch route", extra={"request_id": request_id, "error": str(e)}
+        )
         plan["google_route"] = None
 
     # 4) Enrich days: replace any Wikimedia URL via Google Places Photos
+    with time_stage("photos"):
+        skipped = enrich_plan_photos(
+            plan, destination, photo_futures, calls.stage(PHOTO_BUDGET_SECONDS)
+        )
+    if skipped:
+        DEGRADED.labels("photos").inc()
+        degraded.append("photos")
+        log.warning(
+            "Photo budget ran out, saving plan without some photos",
+            extra={"request_id": request_id, "skipped_slots": skipped},
+        )
 
-    for day in plan.get("days", []):
-        for slot in ("morning", "noon", "evening"):
-            entry = day.get(slot)
-            if not entry:
-                continue
-
-            # use the slot’s place_name (or fall back to destination)
-            place_query = entry.get("place_name", destination)
-            print(f"🔄 Replacing image for {slot} at `{place_query}`")
-
-            # fetch a real photo URL (or empty string)
-            new_url = get_google_place_photo(place_query) or ""
-            entry["image_url"] = new_url
-            print(f"   → got: {new_url}")
-
-    # 5) Persist to DB
-    with psycopg2.connect(STATE_DB_URL) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                UPDATE requests
-                   SET status = %s,
-                       result = %s
-                 WHERE request_id = %s
-                """,
-                ("done", json.dumps(plan), request_id),
-            )
-        conn.commit()
+    # 5) Persist result, trips and history in one transaction
+    with time_stage("persist"):
+        item = (message, plan, route_detail, tuple(degraded))
+        if result_writer is not None:
+            result_writer.submit(item).result()
+        else:
+            persist_result(*item)
 
-    print(f"✅ Completed {request_id}")
+    log.info(
+        "✅ Completed",
+        extra={"request_id": request_id, "days": len(plan.get("days") or [])},
+    )
 
 
 # def process_task(message: dict):
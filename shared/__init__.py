@@ -1,5 +1,5 @@
-from shared.config import KAFKA_TOPIC, KAFKA_BOOTSTRAP_SERVERS, APP_DB_URL
+from shared.config import KAFKA_TOPIC, KAFKA_TOPIC_LONG, KAFKA_BOOTSTRAP_SERVERS, APP_DB_URL
 
 # __all__ = ["KAFKA_TOPIC", "KAFKA_BOOTSTRAP_SERVERS", "STATE_DB_URL", "APP_DB_URL"]
 
-__all__ = ["KAFKA_TOPIC", "KAFKA_BOOTSTRAP_SERVERS", "APP_DB_URL"]
+__all__ = ["KAFKA_TOPIC", "KAFKA_TOPIC_LONG", "KAFKA_BOOTSTRAP_SERVERS", "APP_DB_URL"]
@@ -0,0 +1,69 @@
+import hashlib
+import json
+import re
+from datetime import date, datetime
+
+FINGERPRINT_VERSION = 1
+
+
+def normalize_destination(destination: str) -> str:
+    """'  Berlin,  Germany ' -> 'berlin germany'"""
+    return " ".join(re.sub(r"[^\w\s]", " ", destination.lower()).split())
+
+
+def normalize_interests(interests) -> list:
+    return sorted({i.strip().lower() for i in interests or [] if i and i.strip()})
+
+
+def parse_date(value):
+    """'2026-1-5', '2026-01-05' or a date -> date(2026, 1, 5); None if unparseable."""
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value).strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def normalize_date(value) -> str:
+    """ISO form of a date as the DB stores it; unparseable input is kept as is."""
+    parsed = parse_date(value)
+    return parsed.isoformat() if parsed else str(value)
+
+
+def trip_length_days(start_date: str, end_date: str):
+    """Inclusive number of days between two dates, or None if unparseable."""
+    start, end = parse_date(start_date), parse_date(end_date)
+    if start is None or end is None:
+        return None
+    return (end - start).days + 1
+
+
+def trip_fingerprint(
+    destination: str, start_date: str, end_date: str, interests, by_dates=False
+) -> str:
+    """
+    Canonical hash of a trip request.
+    By default the dates collapse to the trip length, so every "Berlin,
+    3 days, food+history" request shares one fingerprint; by_dates=True keeps
+    the exact dates for callers that need strict equality. Dates are
+    normalized to ISO first, so "2026-1-5" matches a trip stored as 2026-01-05.
+    """
+    key = {
+        "v": FINGERPRINT_VERSION,
+        "destination": normalize_destination(destination),
+        "interests": normalize_interests(interests),
+    }
+    length = trip_length_days(start_date, end_date)
+    if by_dates or length is None:
+        key["dates"] = [normalize_date(start_date), normalize_date(end_date)]
+    else:
+        key["days"] = length
+    canonical = json.dumps(key, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def content_hash(obj) -> str:
+    """Stable hash of a JSON-serializable value, used as a plan's ETag."""
+    canonical = json.dumps(obj, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
@@ -0,0 +1,171 @@
+"""
+Structured logging shared by the api-server and the logic-worker.
+
+Callers only build a LogRecord and enqueue it; formatting, truncation and the
+actual write happen on a background listener thread. Records are dropped
+(and counted) rather than blocking when the queue is full.
+
+    from shared.logs import configure_logging, get_logger
+    configure_logging("worker")
+    log = get_logger(__name__)
+    log.info("task done", extra={"request_id": rid, "duration_ms": 812})
+
+Pass large bodies as %-args at debug level so they are never formatted unless
+debug logging is on: `log.debug("OpenAI response %s", text)`. Arguments
+are formatted later on the listener thread, so do not pass objects that are
+about to be mutated.
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", 2000))
+
+# attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+
+
+def truncate(value, limit: int = None) -> str:
+    text = value if isinstance(value, str) else str(value)
+    limit = LOG_MAX_FIELD_CHARS if limit is None else limit
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {
+        key: value
+        for key, value in vars(record).items()
+        if key not in _RECORD_ATTRS and not key.startswith("_")
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, service, logger, msg, extras."""
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "msg": truncate(record.getMessage()),
+        }
+        for key, value in _extra_fields(record).items():
+            if not isinstance(value, (int, float, bool, type(None))):
+                value = truncate(value)
+            entry[key] = value
+        if record.exc_info:
+            entry["exc"] = truncate(self.formatException(record.exc_info), 8000)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local runs, extras appended as key=value."""
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record: logging.LogRecord) -> str:
+        when = time.strftime("%H:%M:%S", time.localtime(record.created))
+        line = f"{when} {record.levelname:<7} {self.service} {record.name}: {truncate(record.getMessage())}"
+        extras = " ".join(
+            f"{key}={truncate(value, 200)}" for key, value in _extra_fields(record).items()
+        )
+        if extras:
+            line = f"{line} | {extras}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Enqueues the record as is: unlike QueueHandler.prepare() the message is
+    not formatted on the caller's thread, and a full queue drops the record.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateSampler:
+    """
+    Lets one in `every` calls through, for events that fire per item (per
+    photo slot, per lookup). Check it before logging so skipped calls cost
+    no record at all:
+
+        if _slot_sampler():
+            log.debug("slot enriched", extra={...})
+    """
+
+    def __init__(self, every: int):
+        self.every = max(1, every)
+        self._calls = itertools.count()
+
+    def __call__(self) -> bool:
+        return next(self._calls) % self.every == 0
+
+
+def configure_logging(service: str, level: str = None, fmt: str = None):
+    """
+    Route the root logger through a bounded queue to stdout. Idempotent;
+    later calls only change the level.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level or LOG_LEVEL)
+    if _listener is not None:
+        return
+    formatter = (
+        TextFormatter(service) if (fmt or LOG_FORMAT) == "text" else JsonFormatter(service)
+    )
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(formatter)
+    handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    _listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)